@@ -0,0 +1,172 @@
+import argparse
+import asyncio
+import os
+import re
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+
+from chat import parse_last_event_id
+from main import app, broadcaster, get_room_broadcaster, chat_channels, refresh_presence, count_join
+
+
+# Tryb serwowania przez ASGI. Długo otwarte połączenia (obraz z kamery i kanał push czatu) są obsługiwane
+# jako korutyny w jednej pętli asyncio, więc nie zajmują wątków. Pozostałe strony obsługuje
+# aplikacja Flask w puli WSGI_WORKERS wątków adaptera WSGI.
+#
+# Uruchomienie produkcyjne: python asgi.py --host 0.0.0.0 --port 5000 [--workers 4]
+# albo bezpośrednio: uvicorn asgi:application --workers 4
+#
+# Kilka procesów (--workers) dzieli stan pokojów (kamera, kanały push, obecność) przez szynę pub/sub,
+# więc wymaga brokera: python broker_server.py i PUBSUB_URL=broker://127.0.0.1:7000.
+wsgi_application = WSGIMiddleware(app, workers=int(os.environ.get('WSGI_WORKERS', 10)))
+
+
+async def load_session(scope):
+    # Odczyt sesji z magazynu po identyfikatorze z ciasteczka, bez tworzenia kontekstu żądania. Magazyn
+    # (SQLite) może czekać na blokadę zapisu, więc odczyt idzie do wątku, a nie blokuje pętli.
+    cookies = SimpleCookie()
+    for name, value in scope['headers']:
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+    morsel = cookies.get(app.config['SESSION_COOKIE_NAME'])
+    if morsel is None:
+        return {}
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, app.session_interface.load, app, morsel.value) or {}
+
+
+async def redirect(send, location):
+    await send({'type': 'http.response.start', 'status': 302, 'headers': [(b'location', location.encode())]})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def stream_response(receive, send, content_type, chunks, headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', content_type.encode()), *headers],
+    })
+
+    # Zamknięcie połączenia przez klienta przerywa czekanie na kolejny fragment odpowiedzi
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    iterator = chunks.__aiter__()
+    try:
+        while True:
+            next_chunk = asyncio.ensure_future(iterator.__anext__())
+            await asyncio.wait({next_chunk, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_chunk.done():
+                next_chunk.cancel()
+                try:
+                    await next_chunk
+                except (asyncio.CancelledError, StopAsyncIteration):
+                    pass
+                return
+            try:
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                break
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+        await iterator.aclose()
+
+
+async def video_feed(scope, receive, send):
+    chunks = broadcaster.async_viewer(broadcaster.tier_names[0])
+    await stream_response(receive, send, 'multipart/x-mixed-replace; boundary=frame', chunks)
+
+
+async def room_stream(scope, receive, send, room_code):
+    session = await load_session(scope)
+    if 'user_id' not in session:
+        return await redirect(send, '/login')
+
+    room_broadcaster = get_room_broadcaster(room_code)
+    tier = parse_qs(scope['query_string'].decode()).get('quality', [None])[0]
+    if tier not in room_broadcaster.tier_names:
+        tier = None
+    chunks = room_broadcaster.async_viewer(tier, label=session.get('current_user'))
+    await stream_response(receive, send, 'multipart/x-mixed-replace; boundary=frame', chunks)
+
+
+async def presence_events(room_code, presence_id, last_id=None):
+    # main.presence_stream dla pętli asyncio
+    loop = asyncio.get_running_loop()
+    async for chunk in chat_channels.async_stream(room_code, last_id):
+        if refresh_presence(room_code, presence_id):
+            await loop.run_in_executor(None, count_join, room_code)
+        yield chunk
+
+
+async def room_events(scope, receive, send, room_code):
+    session = await load_session(scope)
+    if 'user_id' not in session:
+        return await redirect(send, '/login')
+
+    request_headers = dict(scope['headers'])
+    query = parse_qs(scope['query_string'].decode())
+    last_id = parse_last_event_id(request_headers.get(b'last-event-id', b'').decode(), query.get('last_id', [None])[0])
+    chunks = presence_events(room_code, session.get('presence_id'), last_id)
+    headers = [(b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')]
+    await stream_response(receive, send, 'text/event-stream', chunks, headers)
+
+
+ROUTES = [
+    (re.compile(r'^/video_feed$'), video_feed),
+    (re.compile(r'^/room/(\d+)/stream$'), room_stream),
+    (re.compile(r'^/room/(\d+)/events$'), room_events),
+]
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        for pattern, handler in ROUTES:
+            match = pattern.match(scope['path'])
+            if match:
+                return await handler(scope, receive, send, *map(int, match.groups()))
+    return await wsgi_application(scope, receive, send)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description='Serwer produkcyjny aplikacji (ASGI)')
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_CONCURRENCY', 1)))
+    args = parser.parse_args()
+
+    if args.workers == 1:
+        uvicorn.run(application, host=args.host, port=args.port, proxy_headers=True)
+        return
+    if not app.config['PUBSUB_URL'].startswith('broker://'):
+        print("Kilka procesów bez brokera: czat, obecność i obraz nie będą wspólne (ustaw PUBSUB_URL)")
+    uvicorn.run('asgi:application', host=args.host, port=args.port, proxy_headers=True, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
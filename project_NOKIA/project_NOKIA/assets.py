@@ -0,0 +1,66 @@
+import json
+import mimetypes
+import os
+
+from flask import request, send_from_directory, url_for as flask_url_for
+
+
+# Pliki statyczne zbudowane przez build_assets.py: kopie z skrótem zawartości w nazwie w static/build
+# (np. style.3f2a9c0d1e4b.css), ich warianty .gz/.br oraz manifest z mapą nazwa -> kopia. Szablony
+# wywołują url_for('static', ...) jak zwykle, a adres wskazuje kopię ze skrótem, którą przeglądarka
+# może trzymać bez sprawdzania (Cache-Control: immutable). Bez zbudowanego manifestu pliki są
+# serwowane jak wcześniej, z ETagiem i odpowiedzią 304, gdy się nie zmieniły.
+BUILD_DIR = 'build'
+MANIFEST_NAME = 'manifest.json'
+
+# Skrypty zewnętrznych bibliotek leżą w repozytorium w static/vendor, strony nie korzystają z CDN.
+# Adresy służą tylko do podmiany wersji: python build_assets.py --update-vendor
+VENDOR_SCRIPTS = {
+    'vendor/jquery.min.js': 'https://code.jquery.com/jquery-3.5.1.min.js',
+    'vendor/bootstrap.bundle.min.js': 'https://cdn.jsdelivr.net/npm/bootstrap@4.5.3/dist/js/bootstrap.bundle.min.js',
+}
+
+# Wstępnie skompresowane warianty w kolejności preferencji
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class StaticAssets:
+    def __init__(self, app, max_age=365 * 24 * 3600):
+        self.app = app
+        self.max_age = max_age
+        self.manifest = {}
+        self.hashed = set()
+        self.load()
+        app.view_functions['static'] = self.send_static
+        app.jinja_env.globals['url_for'] = self.url_for
+
+    def load(self):
+        try:
+            with open(os.path.join(self.app.static_folder, BUILD_DIR, MANIFEST_NAME)) as file:
+                self.manifest = json.load(file)
+        except FileNotFoundError:
+            self.manifest = {}
+        self.hashed = set(self.manifest.values())
+
+    def url_for(self, endpoint, **values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.manifest.get(values['filename'], values['filename'])
+        return flask_url_for(endpoint, **values)
+
+    def send_static(self, filename):
+        folder = self.app.static_folder
+        if filename not in self.hashed:
+            # Plik bez skrótu w nazwie przeglądarka sprawdza przy każdym użyciu (If-None-Match -> 304)
+            return send_from_directory(folder, filename, max_age=0)
+
+        for encoding, suffix in ENCODINGS:
+            if request.accept_encodings[encoding] and os.path.isfile(os.path.join(folder, filename + suffix)):
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                response = send_from_directory(folder, filename + suffix, mimetype=mimetype, max_age=self.max_age)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(folder, filename, max_age=self.max_age)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.immutable = True
+        return response
@@ -0,0 +1,72 @@
+import argparse
+import os
+import threading
+import time
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from credentials import PasswordHasher, CredentialsBusy
+
+
+# Benchmark sprawdzania haseł przy logowaniu: dla kilku kosztów PBKDF2 podaje czas jednego sprawdzenia,
+# przepustowość puli PasswordHasher przy `--clients` równoczesnych logowaniach (logowania/s w sumie
+# i na rdzeń) oraz ile prób odrzucono, gdy kolejka puli była pełna. Pomaga dobrać
+# PASSWORD_HASH_ITERATIONS do sprzętu: czas pojedynczego logowania wobec liczby logowań na sekundę.
+ITERATIONS = (100000, 300000, 600000)
+PASSWORD = 'correct horse battery staple'
+
+
+def single(stored, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        check_password_hash(stored, PASSWORD)
+    return (time.perf_counter() - start) / count
+
+
+def pool(hasher, stored, clients, duration):
+    done = [0] * clients
+    rejected = [0] * clients
+    deadline = time.monotonic() + duration
+
+    def client(i):
+        while time.monotonic() < deadline:
+            try:
+                hasher.verify(stored, PASSWORD)
+                done[i] += 1
+            except CredentialsBusy:
+                rejected[i] += 1
+                time.sleep(0.001)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(done) / (time.perf_counter() - start), sum(rejected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark hashowania haseł przy logowaniu')
+    parser.add_argument('--iterations', type=int, action='append', help='koszt PBKDF2 (można podać kilka razy)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--max-pending', type=int, default=None)
+    parser.add_argument('--clients', type=int, default=None, help='równoczesne logowania (domyślnie 2 x workers)')
+    parser.add_argument('--duration', type=float, default=3.0)
+    args = parser.parse_args()
+
+    clients = args.clients or 2 * args.workers
+    print(f"wątki puli: {args.workers}, klienci: {clients}")
+    print(f"{'iteracje':>10}{'ms/logowanie':>14}{'1 wątek/s':>11}{'pula/s':>10}{'na rdzeń/s':>12}{'odrzucone':>11}")
+    for iterations in args.iterations or ITERATIONS:
+        hasher = PasswordHasher(iterations, args.workers, args.max_pending)
+        stored = generate_password_hash(PASSWORD, hasher.method)
+        elapsed = single(stored, 5)
+        rate, rejected = pool(hasher, stored, clients, args.duration)
+        hasher.executor.shutdown()
+        print(f"{iterations:>10}{elapsed * 1000:>14.1f}{1 / elapsed:>11.1f}{rate:>10.1f}"
+              f"{rate / args.workers:>12.1f}{rejected:>11}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from sources import SyntheticSource
+from stream import JpegEncoder, frame_parts
+
+
+# Mikrobenchmark kodowania klatek: dawna ścieżka (imencode + tobytes + sklejanie z nagłówkiem multipart)
+# wobec JpegEncoder z osobnym nagłówkiem, oraz pomniejszanie klatki z nowym buforem wobec bufora
+# używanego ponownie. Dla każdego rozmiaru klatki podaje klatki/s, MB/s surowego obrazu
+# i szczyt pamięci przydzielonej w trakcie jednej klatki (tracemalloc).
+SIZES = {
+    '360p': (640, 360),
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+}
+QUALITY = 75
+LEGACY_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+
+
+def test_frame(width, height):
+    # Obraz testowy z szumem, żeby JPEG miał co kodować jak przy obrazie z kamery
+    source = SyntheticSource(width, height)
+    source.open()
+    _, frame = source.read()
+    noise = np.random.default_rng(0).integers(0, 24, frame.shape, dtype=np.uint8)
+    return cv2.add(frame, noise)
+
+
+def legacy_encode(frame):
+    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, QUALITY])
+    return LEGACY_HEADER + buffer.tobytes() + b'\r\n'
+
+
+def encode_with(encoder):
+    def encode(frame):
+        return frame_parts(encoder.encode(frame, QUALITY), time.time())
+    return encode
+
+
+def resize_allocating(frame):
+    return cv2.resize(frame, (640, 360), interpolation=cv2.INTER_AREA)
+
+
+def resize_reusing():
+    buffer = np.empty((360, 640, 3), np.uint8)
+
+    def resize(frame):
+        return cv2.resize(frame, (640, 360), dst=buffer, interpolation=cv2.INTER_AREA)
+    return resize
+
+
+def measure(function, frame, iterations):
+    function(frame)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(frame)
+    elapsed = (time.perf_counter() - start) / iterations
+
+    # Osobny przebieg pod tracemalloc, który spowalnia przydziały pamięci
+    tracemalloc.start()
+    peaks = []
+    for _ in range(min(iterations, 20)):
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        function(frame)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+    return elapsed, sum(peaks) / len(peaks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark kodowania klatek JPEG')
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--size', choices=list(SIZES), action='append')
+    args = parser.parse_args()
+
+    modes = [('legacy', lambda: legacy_encode), ('opencv', lambda: encode_with(JpegEncoder('opencv')))]
+    turbo = JpegEncoder('auto')
+    if turbo.backend == 'turbo':
+        modes.append(('turbo', lambda: encode_with(turbo)))
+    else:
+        print("turbojpeg niedostępne, pomijam tryb turbo")
+    resize_modes = [('resize-alloc', lambda: resize_allocating), ('resize-reuse', resize_reusing)]
+
+    print(f"{'rozmiar':<8}{'tryb':<14}{'klatek/s':>10}{'MB/s':>10}{'KB/klatkę':>12}")
+    for size in args.size or list(SIZES):
+        frame = test_frame(*SIZES[size])
+        raw_mb = frame.nbytes / 1e6
+        for mode, factory in modes + (resize_modes if size != '360p' else []):
+            elapsed, peak = measure(factory(), frame, args.iterations)
+            print(f"{size:<8}{mode:<14}{1 / elapsed:>10.0f}{raw_mb / elapsed:>10.0f}{peak / 1024:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import argparse
+import asyncio
+import math
+import random
+import time
+
+from client import convert_mes_to_table, translate_input, translate_sample
+from controller_server import ControllerServer
+from telemetry import AXIS_COUNT, BUTTON_COUNT, Sample, StreamDecoder
+
+
+# Benchmark łącza telemetrii: serwer z controller_server.py i odbiorca działają lokalnie w jednym procesie.
+# Ostatnia oś każdej próbki niesie jej numer, dzięki czemu odbiorca zna czas wysłania próbki
+# i może policzyć opóźnienie od wysłania do zdekodowania.
+
+
+class LegacyParser:
+    # Stara ścieżka z client.py: convert_mes_to_table + translate_input. Wiadomości są składane
+    # po znaczniku |!, bo samo recv() nie gwarantuje pełnych wiadomości.
+    def __init__(self):
+        self.buffer = ''
+
+    def feed(self, data):
+        self.buffer += data.decode('ascii')
+        messages = self.buffer.split('|!')
+        self.buffer = messages.pop()
+        results = []
+        for message in messages:
+            for row in convert_mes_to_table(message + '|!'):
+                lines = translate_input(row)
+                results.append((int(float(row[0].split(',')[-1])), lines))
+        return results
+
+
+class DecoderParser:
+    def __init__(self):
+        self.decoder = StreamDecoder()
+
+    def feed(self, data):
+        return [(int(sample.axes[-1]), translate_sample(sample))
+                for event, sample in self.decoder.feed(data) if event == 'sample']
+
+
+MODES = {
+    'legacy-text': ('text', LegacyParser),
+    'decoder-text': ('text', DecoderParser),
+    'decoder-binary': ('binary', DecoderParser),
+    'decoder-delta': ('delta', DecoderParser),
+}
+
+
+def percentile(values, fraction):
+    index = min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+async def run_mode(mode, samples, rate, batch):
+    fmt, parser_class = MODES[mode]
+    send_times = {}
+
+    def sample_source(seq):
+        send_times[seq] = time.perf_counter()
+        axes = tuple(round(random.uniform(-1, 1), 4) for _ in range(AXIS_COUNT - 1)) + (float(seq),)
+        return Sample(axes, tuple(random.random() < 0.1 for _ in range(BUTTON_COUNT)))
+
+    server = await ControllerServer(rate, fmt, batch, sample_source, limit=samples).start('127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    await reader.readexactly(4)
+    writer.write(b'bench')
+    await writer.drain()
+
+    parser = parser_class()
+    latencies = []
+    parse_time = 0
+    received_bytes = 0
+    start = time.perf_counter()
+    while len(latencies) < samples:
+        data = await reader.read(65536)
+        if not data:
+            break
+        received_bytes += len(data)
+        parse_start = time.perf_counter()
+        results = parser.feed(data)
+        now = time.perf_counter()
+        parse_time += now - parse_start
+        latencies.extend(now - send_times.pop(seq) for seq, _ in results)
+    elapsed = time.perf_counter() - start
+
+    writer.close()
+    server.close()
+    await server.wait_closed()
+
+    latencies.sort()
+    count = len(latencies)
+    return {
+        'samples_per_second': count / elapsed,
+        'parse_us': parse_time / count * 1e6,
+        'bytes_per_sample': received_bytes / count,
+        'p50_ms': percentile(latencies, 0.5) * 1e3,
+        'p90_ms': percentile(latencies, 0.9) * 1e3,
+        'p99_ms': percentile(latencies, 0.99) * 1e3,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark łącza telemetrii kontrolera')
+    parser.add_argument('--samples', type=int, default=20000)
+    parser.add_argument('--rate', type=float, default=0, help='próbek na sekundę, 0 = bez ograniczenia')
+    parser.add_argument('--batch', type=int, default=1, help='próbek w jednej wiadomości serwera')
+    parser.add_argument('--mode', choices=sorted(MODES), action='append')
+    args = parser.parse_args()
+
+    print(f"{'tryb':<16}{'próbek/s':>12}{'parsowanie µs':>15}{'bajtów/próbkę':>15}"
+          f"{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}")
+    for mode in args.mode or list(MODES):
+        result = asyncio.run(run_mode(mode, args.samples, args.rate, args.batch))
+        print(f"{mode:<16}{result['samples_per_second']:>12.0f}{result['parse_us']:>15.2f}"
+              f"{result['bytes_per_sample']:>15.1f}{result['p50_ms']:>9.2f}{result['p90_ms']:>9.2f}"
+              f"{result['p99_ms']:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import time
+
+from pubsub import (MESSAGE, LEASE_REQUEST, LEASE_REPLY_BODY, SUBSCRIBE, UNSUBSCRIBE, PUBLISH, LEASE, LEASE_REPLY,
+                    encode_message)
+
+
+# Lokalny broker pub/sub dla pubsub.BrokerBus - zastępuje zewnętrzny broker przy uruchomieniu aplikacji
+# w kilku procesach lub na kilku maszynach. Przekazuje wiadomości subskrybentom tematu (bez nadawcy)
+# i przydziela dzierżawy, które wygasają po czasie albo po rozłączeniu właściciela.
+#
+# Uruchomienie: python broker_server.py --port 7000
+# i w każdym procesie aplikacji: PUBSUB_URL=broker://127.0.0.1:7000
+
+# Odbiorca, który ma tyle niewysłanych bajtów, traci kolejne wiadomości zamiast zapełniać pamięć brokera
+MAX_BUFFER = 8 * 1024 * 1024
+
+
+class Broker:
+    def __init__(self, max_buffer=MAX_BUFFER):
+        self.max_buffer = max_buffer
+        self.topics = {}
+        self.leases = {}
+
+    async def handle(self, reader, writer):
+        topics = set()
+        try:
+            while True:
+                op, topic_length, payload_length = MESSAGE.unpack(await reader.readexactly(MESSAGE.size))
+                topic = (await reader.readexactly(topic_length)).decode()
+                payload = await reader.readexactly(payload_length) if payload_length else b''
+                if op == SUBSCRIBE:
+                    self.topics.setdefault(topic, set()).add(writer)
+                    topics.add(topic)
+                elif op == UNSUBSCRIBE:
+                    self.unsubscribe(topic, writer)
+                    topics.discard(topic)
+                elif op == PUBLISH:
+                    self.publish(topic, payload, writer)
+                elif op == LEASE:
+                    self.lease(topic, payload, writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for topic in topics:
+                self.unsubscribe(topic, writer)
+            for name in [name for name, (holder, _) in self.leases.items() if holder is writer]:
+                del self.leases[name]
+            writer.close()
+
+    def unsubscribe(self, topic, writer):
+        subscribers = self.topics.get(topic)
+        if subscribers is None:
+            return
+        subscribers.discard(writer)
+        if not subscribers:
+            del self.topics[topic]
+
+    def publish(self, topic, payload, sender):
+        subscribers = self.topics.get(topic)
+        if not subscribers:
+            return
+        data = encode_message(PUBLISH, topic, payload)
+        for subscriber in subscribers:
+            if subscriber is sender or subscriber.is_closing() \
+                    or subscriber.transport.get_write_buffer_size() > self.max_buffer:
+                continue
+            subscriber.write(data)
+
+    def lease(self, name, payload, writer):
+        request_id, ttl_ms = LEASE_REQUEST.unpack(payload)
+        now = time.monotonic()
+        holder = self.leases.get(name)
+        if ttl_ms == 0:
+            if holder is not None and holder[0] is writer:
+                del self.leases[name]
+            return
+
+        granted = holder is None or holder[0] is writer or holder[1] < now
+        if granted:
+            self.leases[name] = (writer, now + ttl_ms / 1000)
+        writer.write(encode_message(LEASE_REPLY, name, LEASE_REPLY_BODY.pack(request_id, granted)))
+
+    async def start(self, host='127.0.0.1', port=7000):
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def serve(args):
+    server = await Broker().start(args.host, args.port)
+    print(f"Pub/sub broker on {args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lokalny broker pub/sub dla wielu procesów aplikacji')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7000)
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
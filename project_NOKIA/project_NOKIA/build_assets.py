@@ -0,0 +1,162 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import urllib.request
+
+import cv2
+
+# Kompresja brotli jest opcjonalna (pakiet Brotli); bez niego powstają tylko warianty .gz
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from assets import BUILD_DIR, MANIFEST_NAME, VENDOR_SCRIPTS
+
+
+# Budowanie plików statycznych przed wdrożeniem:
+#   1. na żądanie (--update-vendor) pobranie nowych wersji jQuery i Bootstrap JS do static/vendor,
+#   2. warianty tła w kilku szerokościach, każdy jako JPEG i WebP,
+#   3. kopie wszystkich plików ze skrótem zawartości w nazwie w static/build, adresy /static/...
+#      w CSS wskazują kopie, a style.css dostaje reguły wybierające wariant tła do szerokości ekranu,
+#   4. warianty .gz i .br plików tekstowych oraz manifest dla assets.StaticAssets.
+#
+# Uruchomienie: python build_assets.py, a potem restart aplikacji (manifest jest czytany przy starcie)
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+BACKGROUND = 'background.jpg'
+BACKGROUND_WIDTHS = (640, 1280, 1920)
+JPEG_QUALITY = 80
+WEBP_QUALITY = 80
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt')
+CSS_URL = re.compile(r"""url\(\s*['"]?/static/([^'")]+)['"]?\s*\)""")
+
+
+def vendor_scripts(static_dir):
+    # Pobrane pliki trzeba zatwierdzić w repozytorium razem ze zmienionymi adresami w assets.VENDOR_SCRIPTS
+    for filename, url in VENDOR_SCRIPTS.items():
+        path = os.path.join(static_dir, filename)
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                data = response.read()
+        except OSError as e:
+            print(f"Vendor script error: {url}: {e}")
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(data)
+        print(f"Pobrano {filename} ({len(data)} B)")
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(data)
+
+
+def fingerprint(static_dir, name, data, manifest, sizes):
+    root, extension = os.path.splitext(name)
+    hashed = f'{BUILD_DIR}/{root}.{hashlib.sha256(data).hexdigest()[:12]}{extension}'
+    path = os.path.join(static_dir, hashed)
+    write_file(path, data)
+    size = [len(data), None, None]
+    if extension in COMPRESSIBLE:
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        write_file(path + '.gz', compressed)
+        size[1] = len(compressed)
+        if brotli is not None:
+            compressed = brotli.compress(data, quality=11)
+            write_file(path + '.br', compressed)
+            size[2] = len(compressed)
+    manifest[name] = hashed
+    sizes[name] = size
+    return hashed
+
+
+def background_variants(static_dir, manifest, sizes):
+    # Zwraca [(szerokość, kopia JPEG, kopia WebP)] od najwęższego; największy wariant ma pełną szerokość
+    image = cv2.imread(os.path.join(static_dir, BACKGROUND))
+    if image is None:
+        return []
+    height, width = image.shape[:2]
+    root = os.path.splitext(BACKGROUND)[0]
+    variants = []
+    for target in [w for w in BACKGROUND_WIDTHS if w < width] + [width]:
+        resized = image if target == width else \
+            cv2.resize(image, (target, round(height * target / width)), interpolation=cv2.INTER_AREA)
+        jpeg = cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY,
+                                              cv2.IMWRITE_JPEG_PROGRESSIVE, 1])[1].tobytes()
+        webp = cv2.imencode('.webp', resized, [cv2.IMWRITE_WEBP_QUALITY, WEBP_QUALITY])[1].tobytes()
+        variants.append((target, fingerprint(static_dir, f'{root}-{target}.jpg', jpeg, manifest, sizes),
+                         fingerprint(static_dir, f'{root}-{target}.webp', webp, manifest, sizes)))
+    return variants
+
+
+def background_css(variants):
+    # Największy wariant domyślnie, węższe dla węższych ekranów; przeglądarki z image-set() wybierają WebP
+    rules = ['/* Warianty tła wygenerowane przez build_assets.py */']
+    for i, (width, jpeg, webp) in enumerate(reversed(variants)):
+        declaration = (f"html, body {{ background-image: url('/static/{jpeg}'); "
+                       f"background-image: image-set(url('/static/{webp}') type('image/webp'), "
+                       f"url('/static/{jpeg}') type('image/jpeg')); }}")
+        rules.append(declaration if i == 0 else f"@media (max-width: {width}px) {{ {declaration} }}")
+    return '\n'.join(rules) + '\n'
+
+
+def source_files(static_dir):
+    # Pliki źródłowe bez katalogu build, arkusze CSS na końcu, bo wskazują kopie pozostałych plików
+    names = []
+    for directory, subdirectories, files in os.walk(static_dir):
+        if directory == static_dir and BUILD_DIR in subdirectories:
+            subdirectories.remove(BUILD_DIR)
+        for file in files:
+            names.append(os.path.relpath(os.path.join(directory, file), static_dir).replace(os.sep, '/'))
+    return sorted(names, key=lambda name: (name.endswith('.css'), name))
+
+
+def build(static_dir, clean=False):
+    if clean:
+        shutil.rmtree(os.path.join(static_dir, BUILD_DIR), ignore_errors=True)
+
+    manifest = {}
+    sizes = {}
+    variants = background_variants(static_dir, manifest, sizes)
+    for name in source_files(static_dir):
+        with open(os.path.join(static_dir, name), 'rb') as file:
+            data = file.read()
+        if name.endswith('.css'):
+            text = CSS_URL.sub(lambda match: f"url('/static/{manifest.get(match.group(1), match.group(1))}')",
+                               data.decode())
+            if name == 'style.css' and variants:
+                text += '\n' + background_css(variants)
+            data = text.encode()
+        fingerprint(static_dir, name, data, manifest, sizes)
+
+    write_file(os.path.join(static_dir, BUILD_DIR, MANIFEST_NAME), json.dumps(manifest, indent=2).encode())
+    return manifest, sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Budowanie plików statycznych (skróty w nazwach, kompresja, tła)')
+    parser.add_argument('--static', default=STATIC_DIR)
+    parser.add_argument('--clean', action='store_true', help='usuń poprzednie kopie z static/build')
+    parser.add_argument('--update-vendor', action='store_true',
+                        help='pobierz skrypty z assets.VENDOR_SCRIPTS do static/vendor')
+    args = parser.parse_args()
+
+    if args.update_vendor:
+        vendor_scripts(args.static)
+    if brotli is None:
+        print("Pakiet Brotli niedostępny, pomijam warianty .br")
+
+    manifest, sizes = build(args.static, args.clean)
+    print(f"{'plik':<28}{'bajty':>10}{'gzip':>10}{'brotli':>10}  kopia")
+    for name, (raw, gzipped, brotlied) in sorted(sizes.items()):
+        print(f"{name:<28}{raw:>10}{gzipped or '-':>10}{brotlied or '-':>10}  {manifest[name]}")
+
+
+if __name__ == '__main__':
+    main()
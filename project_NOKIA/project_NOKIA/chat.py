@@ -0,0 +1,448 @@
+import asyncio
+import atexit
+import json
+import math
+import queue
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+
+from sqlalchemy.exc import OperationalError
+
+from db import db, ChatMessage
+
+
+# Co ile sekund wysyłamy pusty komentarz, żeby połączenie nie zostało zamknięte przez proxy
+KEEPALIVE_INTERVAL = 15
+# Temat szyny pub/sub, którym zdarzenia czatu wszystkich spotkań docierają do każdego procesu
+CHAT_TOPIC = 'chat'
+# Najdłuższa wiadomość, jaką przyjmuje kolumna MessageContent
+MESSAGE_MAX_LENGTH = ChatMessage.__table__.c.MessageContent.type.length
+
+
+class Subscription:
+    def __init__(self, queue_size):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.closed = False
+
+    def deliver(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # Klient, który nie odbiera zdarzeń, zostaje rozłączony i połączy się ponownie
+            self.closed = True
+
+
+class AsyncSubscription:
+    # Subskrypcja obsługiwana w pętli asyncio; zdarzenia z innych wątków są przekazywane do pętli
+    def __init__(self, queue_size):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.closed = False
+
+    def deliver(self, item):
+        self.loop.call_soon_threadsafe(self._put, item)
+
+    def _put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.closed = True
+
+
+class ChatChannels:
+    # Kanał push dla każdego spotkania; każdy podłączony klient ma własną kolejkę zdarzeń. Zdarzenia
+    # idą przez szynę pub/sub (pubsub.py), więc trafiają do klientów podłączonych do dowolnego procesu.
+    # on_remote(meeting_id, event, data) jest wywoływane dla zdarzeń opublikowanych w innym procesie.
+    # replay(meeting_id, last_id) zwraca wiadomości o numerze większym niż last_id - klient, który
+    # połączył się ponownie (nagłówek Last-Event-ID) albo dopiero otworzył stronę, dostaje je przed
+    # nowymi zdarzeniami.
+    def __init__(self, bus, queue_size=100, on_remote=None, replay=None):
+        self.bus = bus
+        self.queue_size = queue_size
+        self.on_remote = on_remote
+        self.replay = replay
+        self.origin = secrets.token_hex(8)
+        self.channels = {}
+        self.lock = threading.Lock()
+        bus.subscribe(CHAT_TOPIC, self._on_event)
+
+    def subscribe(self, meeting_id, subscription=None):
+        if subscription is None:
+            subscription = Subscription(self.queue_size)
+        with self.lock:
+            self.channels.setdefault(meeting_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, meeting_id, subscription):
+        with self.lock:
+            subscribers = self.channels.get(meeting_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.channels[meeting_id]
+
+    def publish(self, meeting_id, event, data, event_id=None):
+        message = {'origin': self.origin, 'meeting_id': meeting_id, 'event': event, 'data': data, 'id': event_id}
+        self.bus.publish(CHAT_TOPIC, json.dumps(message).encode())
+
+    def _on_event(self, payload):
+        message = json.loads(payload)
+        meeting_id = message['meeting_id']
+        if message['origin'] != self.origin and self.on_remote is not None:
+            self.on_remote(meeting_id, message['event'], message['data'])
+        with self.lock:
+            subscribers = list(self.channels.get(meeting_id, ()))
+        for subscription in subscribers:
+            subscription.deliver((message['event'], message['data'], message['id']))
+
+    def _missed(self, meeting_id, last_id):
+        if last_id is None or self.replay is None:
+            return []
+        try:
+            return self.replay(meeting_id, last_id)
+        except Exception as e:
+            print(f"Chat replay error: {e}")
+            return []
+
+    def stream(self, meeting_id, last_id=None):
+        # Subskrypcja powstaje przed odczytem zaległych wiadomości, więc nic nie ginie pomiędzy;
+        # wiadomość, która przyjdzie obiema drogami, jest wysyłana raz
+        subscription = self.subscribe(meeting_id)
+        try:
+            yield 'retry: 3000\n\n'
+            for data in self._missed(meeting_id, last_id):
+                last_id = data['id']
+                yield format_event('message', data, last_id)
+            while not subscription.closed:
+                try:
+                    event, data, event_id = subscription.queue.get(timeout=KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if not is_replayed(event_id, last_id):
+                    yield format_event(event, data, event_id)
+        finally:
+            self.unsubscribe(meeting_id, subscription)
+
+    async def async_stream(self, meeting_id, last_id=None):
+        # To samo co stream(), ale oczekiwanie na zdarzenia nie zajmuje wątku
+        subscription = self.subscribe(meeting_id, AsyncSubscription(self.queue_size))
+        try:
+            yield 'retry: 3000\n\n'
+            missed = await asyncio.get_running_loop().run_in_executor(None, self._missed, meeting_id, last_id)
+            for data in missed:
+                last_id = data['id']
+                yield format_event('message', data, last_id)
+            while not subscription.closed:
+                try:
+                    event, data, event_id = await asyncio.wait_for(subscription.queue.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                if not is_replayed(event_id, last_id):
+                    yield format_event(event, data, event_id)
+        finally:
+            self.unsubscribe(meeting_id, subscription)
+
+
+def is_replayed(event_id, last_id):
+    return event_id is not None and last_id is not None and event_id <= last_id
+
+
+def parse_last_event_id(*values):
+    # Numer ostatniej wiadomości z nagłówka Last-Event-ID albo parametru last_id (pierwsza poprawna wartość)
+    for value in values:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def format_event(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def message_to_dict(message_id, user_name, content):
+    return {'id': message_id, 'user': user_name, 'content': content}
+
+
+class ChatBufferFull(Exception):
+    pass
+
+
+class ChatWriter:
+    # Zapis wiadomości czatu do bazy w jednym z dwóch trybów:
+    #
+    # 'sync'  - każda wiadomość jest zatwierdzana w bazie przed odpowiedzią na żądanie (jedno fsync
+    #           na wiadomość). Wiadomość, którą zobaczył nadawca, przetrwa awarię serwera.
+    # 'batch' - wiadomość trafia do bufora w pamięci. Wątek w tle zapisuje bufor jedną transakcją, gdy
+    #           uzbiera się `batch_size` wiadomości albo minie `flush_interval` sekund. Przy zwykłym
+    #           zamknięciu procesu zapisywany jest cały bufor, ale nagłe zabicie procesu traci wiadomości
+    #           z ostatnich `flush_interval` sekund. Gdy baza nie nadąża i w buforze jest `max_pending`
+    #           wiadomości, kolejne są odrzucane wyjątkiem ChatBufferFull.
+    #
+    # W obu trybach on_stored(meeting_id, data) jest wywoływane po zapisie, gdy wiadomość ma już numer
+    # MessageID. W trybie 'batch' wiadomość jest widoczna wcześniej: on_accepted(meeting_id, data) dostaje
+    # ją od razu w write(), bez numeru (id None) i z losowym kluczem 'key', po którym zapisana wersja
+    # z numerem zastępuje tymczasową. Wiadomość odrzuconą przez bazę dostaje on_dropped(meeting_id, data).
+    def __init__(self, app, mode='batch', batch_size=200, flush_interval=0.2, on_stored=None,
+                 max_attempts=3, max_pending=10000, on_accepted=None, on_dropped=None):
+        if mode not in ('sync', 'batch'):
+            raise ValueError(f"Unknown chat write mode: {mode}")
+        self.app = app
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_stored = on_stored
+        self.on_accepted = on_accepted
+        self.on_dropped = on_dropped
+        self.max_attempts = max_attempts
+        self.max_pending = max_pending
+        self.failures = 0
+        self.pending = []
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+
+    def write(self, user_id, user_name, meeting_id, content):
+        data = message_to_dict(None, user_name, content)
+        if self.mode == 'sync':
+            new_message = ChatMessage(UserID=user_id, MeetingID=meeting_id, MessageContent=content)
+            db.session.add(new_message)
+            db.session.commit()
+            data['id'] = new_message.MessageID
+            self._notify(self.on_stored, [(meeting_id, data)])
+            return
+
+        data['key'] = secrets.token_hex(8)
+        with self.condition:
+            if len(self.pending) >= self.max_pending:
+                raise ChatBufferFull()
+            self.pending.append((user_id, meeting_id, data))
+            if len(self.pending) >= self.batch_size:
+                self.condition.notify()
+        # Kopia, bo numer jest dopisywany do `data` dopiero po zapisie
+        self._notify(self.on_accepted, [(meeting_id, dict(data))])
+        self.start()
+
+    def start(self):
+        with self.condition:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                deadline = time.monotonic() + self.flush_interval
+                while len(self.pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Chat flush error: {e}")
+                time.sleep(self.flush_interval)
+
+    def close(self):
+        # Przy zamknięciu procesu zapisujemy cały bufor porcja po porcji, a nie tylko pierwszą porcję
+        while True:
+            try:
+                if not self.flush():
+                    return
+            except OperationalError as e:
+                print(f"Chat flush error: {e}")
+                return
+            except Exception as e:
+                print(f"Chat flush error: {e}")
+
+    def flush(self):
+        # Zapisuje pierwszą porcję bufora i zwraca jej długość. Porcja, która nie przechodzi `max_attempts`
+        # razy z rzędu, jest zapisywana po jednej wiadomości: wiadomości odrzucane przez bazę (np. za długie)
+        # są pomijane, żeby nie blokowały kolejnych. Przy niedostępnej bazie (OperationalError) czekają dalej.
+        with self.flush_lock:
+            with self.condition:
+                batch = self.pending[:self.batch_size]
+            if not batch:
+                return 0
+
+            with self.app.app_context():
+                try:
+                    stored = self._insert(batch)
+                except Exception as e:
+                    self.failures += 1
+                    if self.failures < self.max_attempts:
+                        raise
+                    print(f"Chat flush error: {e}, saving messages one by one")
+                    stored = []
+                    dropped = []
+                    done = 0
+                    for item in batch:
+                        try:
+                            stored += self._insert([item])
+                        except OperationalError as e:
+                            print(f"Chat flush error: {e}")
+                            break
+                        except Exception as e:
+                            print(f"Chat message dropped (meeting {item[1]}): {e}")
+                            dropped.append(item[1:])
+                        done += 1
+                    # Przy niedostępnej bazie z bufora znikają tylko już obsłużone wiadomości
+                    batch = batch[:done]
+                    self._notify(self.on_dropped, dropped)
+                if stored or batch:
+                    self.failures = 0
+
+            with self.condition:
+                del self.pending[:len(batch)]
+            self._notify(self.on_stored, stored)
+            return len(batch)
+
+    def _insert(self, batch):
+        rows = [ChatMessage(UserID=user_id, MeetingID=meeting_id, MessageContent=data['content'])
+                for user_id, meeting_id, data in batch]
+        try:
+            db.session.add_all(rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        stored = []
+        for row, (_, meeting_id, data) in zip(rows, batch):
+            data['id'] = row.MessageID
+            stored.append((meeting_id, data))
+        return stored
+
+    def _notify(self, callback, messages):
+        if callback is None:
+            return
+        for meeting_id, data in messages:
+            try:
+                callback(meeting_id, data)
+            except Exception as e:
+                print(f"Chat callback error: {e}")
+
+
+def message_order(message):
+    return math.inf if message['id'] is None else message['id']
+
+
+class CachedMeeting:
+    def __init__(self, messages, has_older, size):
+        self.messages = deque(messages, maxlen=size)
+        self.has_older = has_older or len(messages) > size
+
+
+class RecentMessageCache:
+    # Ostatnie wiadomości aktywnych spotkań razem z nazwą autora. Spotkanie trafia do pamięci przy
+    # pierwszym otwarciu pokoju, nowe wiadomości są dopisywane przy wysyłce, a najdawniej używane
+    # spotkania są usuwane, gdy jest ich więcej niż `max_meetings`.
+    def __init__(self, per_meeting=300, max_meetings=500):
+        self.per_meeting = per_meeting
+        self.max_meetings = max_meetings
+        self.meetings = OrderedDict()
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def get(self, meeting_id, limit):
+        # Zwraca (wiadomości, czy są starsze) albo None, jeśli w pamięci nie ma tylu wiadomości spotkania
+        with self.lock:
+            cached = self.meetings.get(meeting_id)
+            if cached is None or (cached.has_older and len(cached.messages) < limit):
+                return None
+            self.meetings.move_to_end(meeting_id)
+            messages = list(cached.messages)
+        has_more = cached.has_older or len(messages) > limit
+        return [dict(message) for message in messages[-limit:]], has_more
+
+    def generation(self, meeting_id):
+        with self.lock:
+            return self.generations.get(meeting_id, 0)
+
+    def after(self, meeting_id, message_id):
+        # Wiadomości o numerze większym niż message_id albo None, jeśli pamięć nie sięga tak daleko
+        with self.lock:
+            cached = self.meetings.get(meeting_id)
+            if cached is None:
+                return None
+            # Wiadomości czekające na zapis nie mają jeszcze numeru, klient dostanie je po zapisie
+            stored = [message for message in cached.messages if message['id'] is not None]
+            if cached.has_older and (not stored or stored[0]['id'] > message_id):
+                return None
+        return [dict(message) for message in stored if message['id'] > message_id]
+
+    def fill(self, meeting_id, messages, has_older, generation):
+        # Jeśli w trakcie czytania z bazy ktoś wysłał wiadomość, odczyt mógł ją pominąć i nie trafia do pamięci
+        with self.lock:
+            if self.generations.get(meeting_id, 0) != generation:
+                return
+            self.meetings[meeting_id] = CachedMeeting(messages, has_older, self.per_meeting)
+            while len(self.meetings) > self.max_meetings:
+                evicted, _ = self.meetings.popitem(last=False)
+                self.generations.pop(evicted, None)
+
+    def append(self, meeting_id, message):
+        with self.lock:
+            self.generations[meeting_id] = self.generations.get(meeting_id, 0) + 1
+            cached = self.meetings.get(meeting_id)
+            if cached is None:
+                return
+            # Zapisana wiadomość zastępuje swoją wersję tymczasową (ten sam klucz, bez numeru)
+            key = message.get('key')
+            if key is not None:
+                for position, cached_message in enumerate(cached.messages):
+                    if cached_message.get('key') == key:
+                        if cached_message['id'] is not None or message['id'] is None:
+                            return
+                        del cached.messages[position]
+                        break
+            # Wiadomość z innego procesu mogła już zostać wczytana z bazy albo przyjść przed starszą,
+            # więc szukamy jej miejsca według numeru i pomijamy powtórki. Wiadomości bez numeru są
+            # najnowsze i zostają na końcu.
+            position = len(cached.messages)
+            order = message_order(message)
+            while position and message_order(cached.messages[position - 1]) >= order:
+                if message['id'] is not None and cached.messages[position - 1]['id'] == message['id']:
+                    return
+                if message['id'] is None and cached.messages[position - 1]['id'] is None:
+                    break
+                position -= 1
+            if len(cached.messages) == cached.messages.maxlen:
+                cached.has_older = True
+                if position == 0:
+                    return
+                cached.messages.popleft()
+                position -= 1
+            cached.messages.insert(position, message)
+
+    def discard(self, meeting_id, key):
+        # Usuwa wiadomość czekającą na zapis, której baza nie przyjęła
+        with self.lock:
+            self.generations[meeting_id] = self.generations.get(meeting_id, 0) + 1
+            cached = self.meetings.get(meeting_id)
+            if cached is None:
+                return
+            for message in cached.messages:
+                if message.get('key') == key and message['id'] is None:
+                    cached.messages.remove(message)
+                    return
+
+    def invalidate(self, meeting_ids):
+        with self.lock:
+            for meeting_id in meeting_ids:
+                self.meetings.pop(meeting_id, None)
+                self.generations.pop(meeting_id, None)
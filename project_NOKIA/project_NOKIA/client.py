@@ -1,17 +1,12 @@
-import socket
-import threading
+import asyncio
+import sys
+
+from telemetry import AXIS_NAMES, BUTTON_NAMES, ChangeTracker
+from telemetry_client import ControllerHub
 
 HOST = "192.168.248.20"
 PORT = 9090
 
-name = input("Choose a name:")
-
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server.connect((HOST, PORT))
-
-axis_positions = ["L3_X", "L3_Y", "L3_Z", "R3_X", "R3_Y", "R3_Z"]
-button_states = ["Button L1", "Button R1", "Triangle", "Square", "Circle", "Cross", "Start", "Select", "UP/DOWN", "LEFT/RIGHT"]
-
 
 def convert_mes_to_table(data):
     data = data.replace("data|", "").replace("|!", "")
@@ -32,40 +27,74 @@ def translate_input(data):
     button_data = data[1].split(',')
 
     for i in range(6):
-        translated.append(f"{axis_positions[i]}: {axis_data[i]}")
+        translated.append(f"{AXIS_NAMES[i]}: {axis_data[i]}")
 
     for i in range(10):
-        translated.append(f"{button_states[i]}: {'Pressed' if button_data[i] != '0' else 'Released'}")
+        translated.append(f"{BUTTON_NAMES[i]}: {'Pressed' if button_data[i] != '0' else 'Released'}")
 
     return translated
 
 
-def receive_messages():
-    while True:
-        try:
-            reply = server.recv(4096).decode("ascii")
-            if reply == "NAME":
-                server.sendall(name.encode("ascii"))
-            else:
-                table = convert_mes_to_table(reply)
-                for row in table:
-                    translated_row = translate_input(row)
-                    for item in translated_row:
-                        print(item)
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            server.close()
-            break
-
-
-def send_message():
+def translate_sample(sample):
+    translated = []
+    for i in range(6):
+        translated.append(f"{AXIS_NAMES[i]}: {sample.axes[i]:g}")
+
+    for i in range(10):
+        translated.append(f"{BUTTON_NAMES[i]}: {'Pressed' if sample.buttons[i] else 'Released'}")
+
+    return translated
+
+
+def translate_changes(changes):
+    translated = []
+    for kind, i, value in changes:
+        if kind == 'axis':
+            translated.append(f"{AXIS_NAMES[i]}: {value:g}")
+        else:
+            translated.append(f"{BUTTON_NAMES[i]}: {'Pressed' if value else 'Released'}")
+
+    return translated
+
+
+async def print_samples(hub):
+    # Wypisujemy tylko to, co się zmieniło od poprzedniej próbki danego kontrolera
+    show_address = len(hub.links) > 1
+    trackers = {}
+    async for link, sample in hub:
+        tracker = trackers.setdefault(link, ChangeTracker())
+        for item in translate_changes(tracker.changes(sample)):
+            print(f"[{link.address}] {item}" if show_address else item)
+
+
+async def send_messages(hub):
+    # input() blokuje, więc czeka w osobnym wątku, a nie w pętli asyncio
+    loop = asyncio.get_running_loop()
     while True:
-        message = f"{input('napisz wiadomosc')}"
-        server.send(message.encode("ascii"))
+        message = await loop.run_in_executor(None, input, 'napisz wiadomosc')
+        await hub.send_all(message)
+
+
+async def run(name, addresses):
+    hub = ControllerHub(name)
+    for host, port in addresses:
+        hub.subscribe(host, port)
+    try:
+        await asyncio.gather(print_samples(hub), send_messages(hub))
+    finally:
+        hub.close()
+
+
+def main():
+    # Adresy serwerów kontrolerów jako argumenty host:port, domyślnie HOST:PORT
+    addresses = []
+    for argument in sys.argv[1:]:
+        host, _, port = argument.rpartition(":")
+        addresses.append((host, int(port)))
 
+    name = input("Choose a name:")
+    asyncio.run(run(name, addresses or [(HOST, PORT)]))
 
-receive_thread = threading.Thread(target=receive_messages)
-receive_thread.start()
 
-send_thread = threading.Thread(target=send_message)
-send_thread.start()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import asyncio
+import math
+import random
+
+from telemetry import AXIS_COUNT, BUTTON_COUNT, DeltaEncoder, Sample, encode_samples, encode_text
+
+
+# Lokalny serwer kontrolera zastępujący urządzenie pod 192.168.248.20:9090. Po połączeniu wysyła NAME,
+# czeka na nazwę klienta, a potem nadaje stan kontrolera z zadaną częstotliwością w formacie
+# tekstowym (data|...|!), binarnym albo w trybie zmian (telemetry.py), w którym bezczynny kontroler
+# wysyła tylko okresowe keyframe.
+#
+# Uruchomienie: python controller_server.py --port 9090 --rate 100 --format delta
+# i w drugim terminalu: python client.py 127.0.0.1:9090
+
+
+def synthetic_sample(seq, rate=100):
+    # Płynne ruchy gałek i od czasu do czasu wciśnięty przycisk
+    t = seq / rate
+    axes = tuple(round(math.sin(t * (i + 1) * 0.7), 4) for i in range(AXIS_COUNT))
+    buttons = tuple(random.random() < 0.05 for _ in range(BUTTON_COUNT))
+    return Sample(axes, buttons)
+
+
+def idle_sample(seq, rate=100):
+    # Kontroler odłożony na stół: gałki w środku, nic nie wciśnięte
+    return Sample((0.0,) * AXIS_COUNT, (False,) * BUTTON_COUNT)
+
+
+class ControllerServer:
+    def __init__(self, rate=100, fmt='text', batch=1, sample_source=None, limit=None):
+        self.rate = rate
+        self.fmt = fmt
+        self.batch = batch
+        self.sample_source = sample_source or (lambda seq: synthetic_sample(seq, rate or 100))
+        self.limit = limit
+
+    def encode(self, samples, encoder=None):
+        if encoder is not None:
+            return encoder.encode_samples(samples)
+        return encode_samples(samples) if self.fmt == 'binary' else encode_text(samples)
+
+    async def handle(self, reader, writer):
+        address = writer.get_extra_info('peername')
+        writer.write(b'NAME')
+        await writer.drain()
+        name = (await reader.read(255)).decode('ascii', 'replace')
+        print(f"Client {name} connected from {address}")
+
+        messages = asyncio.ensure_future(self.print_messages(name, reader))
+        # Koder trybu zmian pamięta stan wysłany temu klientowi
+        encoder = DeltaEncoder() if self.fmt == 'delta' else None
+        loop = asyncio.get_running_loop()
+        # Przy rate=0 serwer nadaje tak szybko, jak pozwala połączenie
+        interval = self.batch / self.rate if self.rate else 0
+        next_send = loop.time()
+        seq = 0
+        try:
+            while self.limit is None or seq < self.limit:
+                samples = [self.sample_source(seq + i) for i in range(self.batch)]
+                seq += self.batch
+                data = self.encode(samples, encoder)
+                if data:
+                    writer.write(data)
+                    await writer.drain()
+                if interval and (self.limit is None or seq < self.limit):
+                    next_send += interval
+                    await asyncio.sleep(max(0, next_send - loop.time()))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            messages.cancel()
+            writer.close()
+            print(f"Client {name} disconnected")
+
+    async def print_messages(self, name, reader):
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                return
+            print(f"{name}: {data.decode('ascii', 'replace')}")
+
+    async def start(self, host='127.0.0.1', port=9090):
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def serve(args):
+    sample_source = (lambda seq: idle_sample(seq, args.rate)) if args.idle else None
+    server = await ControllerServer(args.rate, args.format, args.batch, sample_source).start(args.host, args.port)
+    print(f"Controller server on {args.host}:{args.port}, {args.rate} samples/s, format {args.format}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lokalny serwer kontrolera do testów')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9090)
+    parser.add_argument('--rate', type=float, default=100, help='próbek na sekundę, 0 = bez ograniczenia')
+    parser.add_argument('--format', choices=['text', 'binary', 'delta'], default='text')
+    parser.add_argument('--batch', type=int, default=1, help='próbek w jednej wiadomości')
+    parser.add_argument('--idle', action='store_true', help='nieruchomy kontroler zamiast ruchów gałek')
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
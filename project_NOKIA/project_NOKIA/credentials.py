@@ -0,0 +1,50 @@
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+# Początki hashy zapisywanych przez werkzeug; inna wartość w kolumnie Password to hasło jawnym tekstem
+HASH_PREFIXES = ('pbkdf2:', 'scrypt:')
+
+
+class CredentialsBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    # Hashowanie haseł (PBKDF2-SHA256 z werkzeug) w ograniczonej puli wątków. hashlib zwalnia GIL na czas
+    # liczenia, więc pula wykorzystuje wszystkie rdzenie, a wątek obsługujący żądanie tylko czeka na wynik.
+    # Gdy w puli i kolejce jest już `max_pending` zadań, kolejne są odrzucane wyjątkiem CredentialsBusy,
+    # zamiast czekać w coraz dłuższej kolejce.
+    def __init__(self, iterations=600000, workers=None, max_pending=None):
+        self.method = f'pbkdf2:sha256:{iterations}'
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(max_pending or 4 * self.workers)
+        # Hash sprawdzany, gdy użytkownik nie istnieje, żeby odpowiedź trwała tyle samo co przy złym haśle
+        self.dummy_hash = generate_password_hash('', self.method)
+
+    def _run(self, function, *args):
+        if not self.slots.acquire(blocking=False):
+            raise CredentialsBusy()
+        try:
+            return self.executor.submit(function, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, stored, password):
+        # Zwraca (czy hasło pasuje, czy trzeba zapisać nowy hash). `stored` jest None dla nieznanego użytkownika.
+        if stored is None:
+            self._run(check_password_hash, self.dummy_hash, password)
+            return False, False
+        if not stored.startswith(HASH_PREFIXES):
+            # Konto sprzed hashowania: po udanym logowaniu hasło zostanie zapisane jako hash
+            return hmac.compare_digest(stored.encode(), password.encode()), True
+        valid = self._run(check_password_hash, stored, password)
+        return valid, valid and stored.split('$', 1)[0] != self.method
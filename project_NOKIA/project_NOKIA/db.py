@@ -1,25 +1,82 @@
+import os
+from datetime import datetime
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 
 
 # Inicjalizacja obiektu SQLAlchemy
 db = SQLAlchemy()
 
+# Domyślny profil silnika bazy; każdą wartość można nadpisać zmienną środowiskową o tej samej nazwie
+DATABASE_DEFAULTS = {
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_BUSY_TIMEOUT': 5000,
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_FOREIGN_KEYS': 'ON',
+    'DB_POOL_SIZE': 10,
+    'DB_MAX_OVERFLOW': 20,
+    'DB_POOL_TIMEOUT': 30,
+    'DB_POOL_RECYCLE': 3600,
+}
+
+
+def init_database(app, default_uri):
+    # Adres bazy można podmienić przez DATABASE_URL, np. na postgresql://..., modele zostają te same
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', default_uri)
+    for key, default in DATABASE_DEFAULTS.items():
+        value = os.environ.get(key, app.config.get(key, default))
+        app.config[key] = type(default)(value)
+
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+        'pool_recycle': app.config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+    db.init_app(app)
+
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            pragmas = {
+                'journal_mode': app.config['SQLITE_JOURNAL_MODE'],
+                'busy_timeout': app.config['SQLITE_BUSY_TIMEOUT'],
+                'synchronous': app.config['SQLITE_SYNCHRONOUS'],
+                'foreign_keys': app.config['SQLITE_FOREIGN_KEYS'],
+            }
+            event.listen(db.engine, 'connect', lambda connection, _: set_sqlite_pragmas(connection, pragmas))
+
+
+def set_sqlite_pragmas(connection, pragmas):
+    # WAL pozwala czytać w trakcie zapisu, busy_timeout każe czekać na blokadę zamiast zgłaszać "database is locked".
+    # SQLite domyślnie nie sprawdza kluczy obcych; włączamy je, żeby zachowywał się jak PostgreSQL.
+    cursor = connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
+
 # Model tabeli Users
 class User(db.Model):
     UserID = db.Column(db.Integer, primary_key=True)
-    Name = db.Column(db.String(255))
-    Email = db.Column(db.String(255))
+    Name = db.Column(db.String(255), unique=True, index=True)
+    Email = db.Column(db.String(255), unique=True, index=True)
     Password = db.Column(db.String(255))
 
 
 # Model tabeli Meetings
 class Meeting(db.Model):
     MeetingID = db.Column(db.Integer, primary_key=True)
-    attendees_count = db.Column(db.Integer, default=0)  
+    attendees_count = db.Column(db.Integer, default=0, index=True)  
+    last_activity = db.Column(db.DateTime, default=datetime.now, index=True)
 
 
 # Model tabeli ChatMessage
 class ChatMessage(db.Model):
+    __table_args__ = (
+        db.Index('ix_chat_message_meeting_message', 'MeetingID', 'MessageID'),
+    )
+
     MessageID = db.Column(db.Integer, primary_key=True)
     UserID = db.Column(db.Integer, db.ForeignKey('user.UserID'))
     MeetingID = db.Column(db.Integer, db.ForeignKey('meeting.MeetingID'))
@@ -27,3 +84,10 @@ class ChatMessage(db.Model):
 
     user = db.relationship('User', backref='messages')
     meeting = db.relationship('Meeting', backref='messages')
+
+
+# Model tabeli SchedulerLease: zadanie w tle wykonuje tylko proces z ważną dzierżawą
+class SchedulerLease(db.Model):
+    Name = db.Column(db.String(64), primary_key=True)
+    Holder = db.Column(db.String(255))
+    ExpiresAt = db.Column(db.DateTime)
@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+
+from telemetry import ChangeTracker
+from telemetry_client import ControllerHub
+
+
+# Bramka kontrolerów: odbiera próbki z serwerów kontrolerów (telemetry_client) i publikuje zmiany stanu
+# jako zdarzenia 'input' w kanale push pokoju, do którego przypisano kontroler. Zdarzenie niesie
+# czas odebrania próbki przez bramkę (ms od epoki), więc przeglądarka może policzyć opóźnienie
+# od bramki do ekranu.
+#
+# Zmiany są publikowane najwyżej `max_rate` razy na sekundę na kontroler: zmiana, która przyszła
+# przed upływem odstępu, jest dołączana do następnego zdarzenia (ostatnia wartość pola wygrywa).
+#
+# Przy wielu procesach aplikacji z kontrolerami łączy się tylko proces z dzierżawą LEASE_NAME na szynie
+# pub/sub; zdarzenia i tak trafiają przez szynę do widzów we wszystkich procesach.
+LEASE_NAME = 'controller-gateway'
+LEASE_TTL = 10
+
+
+def parse_gateways(value):
+    # "pokój:host:port" rozdzielone przecinkami, np. "123456:192.168.248.20:9090,654321:127.0.0.1:9091"
+    routes = []
+    for entry in value.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        room_code, _, address = entry.partition(':')
+        host, _, port = address.rpartition(':')
+        routes.append((int(room_code), host, int(port)))
+    return routes
+
+
+class InputRoute:
+    def __init__(self, room_code):
+        self.room_code = room_code
+        self.tracker = ChangeTracker()
+        self.pending = {}
+        self.received_at = None
+        self.last_publish = 0
+        self.flush_handle = None
+        self.seq = 0
+
+
+class ControllerGateway:
+    def __init__(self, channels, name='room-gateway', max_rate=60):
+        self.channels = channels
+        self.name = name
+        self.interval = 1 / max_rate if max_rate else 0
+        self.routes = []
+        self.loop = None
+        self.thread = None
+
+    def add(self, room_code, host, port):
+        self.routes.append((room_code, host, port))
+
+    def start(self):
+        # Pętla asyncio bramki działa we własnym wątku procesu aplikacji
+        if self.thread is not None or not self.routes:
+            return
+        self.thread = threading.Thread(target=self._main)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _main(self):
+        while True:
+            if self.channels.bus.try_lease(LEASE_NAME, LEASE_TTL):
+                asyncio.run(self._run())
+            else:
+                time.sleep(LEASE_TTL / 2)
+
+    async def _keep_lease(self):
+        # Kończy się, gdy dzierżawę przejął inny proces
+        while True:
+            await asyncio.sleep(LEASE_TTL / 3)
+            if not await self.loop.run_in_executor(None, self.channels.bus.try_lease, LEASE_NAME, LEASE_TTL):
+                return
+
+    async def _run(self):
+        self.loop = asyncio.get_running_loop()
+        hub = ControllerHub(self.name)
+        routes = {}
+        for room_code, host, port in self.routes:
+            routes[hub.subscribe(host, port)] = InputRoute(room_code)
+
+        lease = asyncio.ensure_future(self._keep_lease())
+        forward = asyncio.ensure_future(self._forward(hub, routes))
+        try:
+            await asyncio.wait({lease, forward}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            lease.cancel()
+            forward.cancel()
+            hub.close()
+
+    async def _forward(self, hub, routes):
+        try:
+            async for link, sample in hub:
+                received_at = time.time()
+                route = routes[link]
+                changes = route.tracker.changes(sample)
+                if not changes:
+                    continue
+                if route.received_at is None:
+                    route.received_at = received_at
+                for kind, i, value in changes:
+                    route.pending[(kind, i)] = value
+                self._schedule(link, route)
+        except Exception as e:
+            print(f"Controller gateway error: {e}")
+
+    def _schedule(self, link, route):
+        if route.flush_handle is not None:
+            return
+        delay = route.last_publish + self.interval - self.loop.time()
+        if delay <= 0:
+            self._publish(link, route)
+        else:
+            route.flush_handle = self.loop.call_later(delay, self._publish, link, route)
+
+    def _publish(self, link, route):
+        route.flush_handle = None
+        route.last_publish = self.loop.time()
+        route.seq += 1
+        data = {
+            'controller': link.address,
+            'seq': route.seq,
+            'changes': [[kind, i, round(value, 4) if kind == 'axis' else value]
+                        for (kind, i), value in route.pending.items()],
+            'received_at': route.received_at * 1000,
+            'published_at': time.time() * 1000,
+        }
+        route.pending = {}
+        route.received_at = None
+        self.channels.publish(route.room_code, 'input', data)
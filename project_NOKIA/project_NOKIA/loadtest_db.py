@@ -0,0 +1,120 @@
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+
+from db import db, init_database, User, Meeting, ChatMessage
+
+
+# Test obciążeniowy bazy: ile odczytów historii czatu na sekundę wytrzymuje baza sama
+# i w trakcie ciągłego zapisu wiadomości, dla profilu domyślnego SQLite i profilu z WAL.
+PROFILES = {
+    'default': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL'},
+    'tuned': {'SQLITE_JOURNAL_MODE': 'WAL', 'SQLITE_SYNCHRONOUS': 'NORMAL'},
+}
+
+
+def create_app(path, profile):
+    app = Flask(__name__)
+    app.config.update(PROFILES[profile])
+    init_database(app, 'sqlite:///' + path)
+    return app
+
+
+def seed(path, profile):
+    app = create_app(path, profile)
+    with app.app_context():
+        db.create_all()
+        user = User(Name='loadtest', Email='loadtest@example.com', Password='-')
+        db.session.add_all([user, Meeting(MeetingID=1)])
+        db.session.commit()
+        db.session.add_all([ChatMessage(UserID=user.UserID, MeetingID=1, MessageContent=f'message {i}')
+                            for i in range(5000)])
+        db.session.commit()
+        db.engine.dispose()
+
+
+# Czytelnicy i piszący działają w osobnych procesach, tak jak osobne procesy serwera aplikacji
+def reader(path, profile, stop, done, errors):
+    app = create_app(path, profile)
+    with app.app_context():
+        while not stop.is_set():
+            try:
+                db.session.query(ChatMessage.MessageID, User.Name, ChatMessage.MessageContent) \
+                    .outerjoin(User, ChatMessage.UserID == User.UserID) \
+                    .filter(ChatMessage.MeetingID == 1) \
+                    .order_by(ChatMessage.MessageID.desc()).limit(50).all()
+                with done.get_lock():
+                    done.value += 1
+            except OperationalError:
+                with errors.get_lock():
+                    errors.value += 1
+            db.session.remove()
+
+
+def writer(path, profile, stop, done, errors):
+    app = create_app(path, profile)
+    with app.app_context():
+        while not stop.is_set():
+            try:
+                db.session.add(ChatMessage(UserID=1, MeetingID=1, MessageContent='load'))
+                db.session.commit()
+                with done.get_lock():
+                    done.value += 1
+            except OperationalError:
+                db.session.rollback()
+                with errors.get_lock():
+                    errors.value += 1
+            db.session.remove()
+
+
+def run(path, profile, readers, writers, duration):
+    stop = multiprocessing.Event()
+    counters = {name: multiprocessing.Value('i', 0) for name in ('reads', 'read_errors', 'writes', 'write_errors')}
+    processes = [multiprocessing.Process(target=reader, args=(path, profile, stop, counters['reads'], counters['read_errors']))
+                 for _ in range(readers)]
+    processes += [multiprocessing.Process(target=writer, args=(path, profile, stop, counters['writes'], counters['write_errors']))
+                  for _ in range(writers)]
+    for process in processes:
+        process.start()
+    # Krótka rozgrzewka, żeby nie liczyć czasu uruchamiania procesów
+    time.sleep(1)
+    start = {name: counter.value for name, counter in counters.items()}
+    time.sleep(duration)
+    result = {name: counter.value - start[name] for name, counter in counters.items()}
+    stop.set()
+    for process in processes:
+        process.join()
+    result['reads'] /= duration
+    result['writes'] /= duration
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Test obciążeniowy odczytów czatu w trakcie zapisu wiadomości')
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--profile', choices=sorted(PROFILES), action='append')
+    args = parser.parse_args()
+
+    for profile in args.profile or sorted(PROFILES):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'loadtest.db')
+            seed(path, profile)
+            idle = run(path, profile, args.readers, 0, args.duration)
+            busy = run(path, profile, args.readers, args.writers, args.duration)
+
+        ratio = busy['reads'] / idle['reads'] if idle['reads'] else 0
+        print(f"[{profile}] odczyty bez zapisu: {idle['reads']:.0f}/s, "
+              f"w trakcie zapisu: {busy['reads']:.0f}/s ({ratio:.0%}), "
+              f"zapisy: {busy['writes']:.0f}/s, "
+              f"błędy odczytu/zapisu: {busy['read_errors']}/{busy['write_errors']}")
+
+
+if __name__ == '__main__':
+    main()
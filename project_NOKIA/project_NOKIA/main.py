@@ -1,43 +1,117 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, Response
+from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, jsonify
 from db import *
 import secrets
 import os
 from flask_login import LoginManager, login_required
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func
+from sqlalchemy import func, case, or_, update
+from sqlalchemy.exc import IntegrityError
 import random
 from datetime import datetime, timedelta
 import time
-import cv2
+from threading import Thread
+from stream import BroadcasterRegistry
+from sources import parse_room_sources
+from chat import ChatChannels, ChatWriter, ChatBufferFull, RecentMessageCache, message_to_dict, \
+    parse_last_event_id, MESSAGE_MAX_LENGTH
+from migrations import upgrade
+from presence import PresenceRegistry
+from reaper import MeetingReaper
+from gateway import ControllerGateway, parse_gateways
+from pubsub import create_bus
+from credentials import PasswordHasher, CredentialsBusy
+from sessions import ServerSessionInterface, create_session_store, load_secret_key
+from ratelimit import RouteLimits, RateLimited, parse_limits
+from assets import StaticAssets
+from pagecache import PageCache
+from jinja2 import FileSystemBytecodeCache
+from telemetry import AXIS_NAMES, BUTTON_NAMES
 
 # Inicjalizacja aplikacji Flask
 app = Flask(__name__)
 
-# Ustawienie sekretnego klucza dla sesji, generowane losowo za każdym razem, gdy aplikacja się uruchamia
-app.secret_key = secrets.token_hex(16)
+# Pliki statyczne zbudowane przez build_assets.py: adresy ze skrótem zawartości i czas przechowywania
+# ich w przeglądarce (sekundy)
+app.config['STATIC_MAX_AGE'] = int(os.environ.get('STATIC_MAX_AGE', 365 * 24 * 3600))
+static_assets = StaticAssets(app, max_age=app.config['STATIC_MAX_AGE'])
 
 # Konfiguracja bazy danych
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'instance', 'database.db')
-db.init_app(app)
 
-# Utworzenie wszystkich tabel w bazie danych, jeśli nie istnieją
+# Strony i fragmenty szablonów zależne tylko od zalogowanego użytkownika są trzymane w pamięci przez
+# PAGE_CACHE_TTL sekund. Skompilowane szablony trafiają do instance/jinja_cache, a przy starcie
+# kompilujemy wszystkie, żeby pierwsze żądania nie czekały na kompilację.
+app.config['PAGE_CACHE'] = os.environ.get('PAGE_CACHE', '1') == '1'
+app.config['PAGE_CACHE_TTL'] = int(os.environ.get('PAGE_CACHE_TTL', 300))
+app.config['PAGE_CACHE_SIZE'] = int(os.environ.get('PAGE_CACHE_SIZE', 1000))
+page_cache = PageCache(ttl=app.config['PAGE_CACHE_TTL'], max_entries=app.config['PAGE_CACHE_SIZE'],
+                       enabled=app.config['PAGE_CACHE'])
+app.jinja_env.globals['cached_fragment'] = page_cache.fragment
+
+jinja_cache_dir = os.path.join(basedir, 'instance', 'jinja_cache')
+os.makedirs(jinja_cache_dir, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(jinja_cache_dir)
+for template_name in app.jinja_env.list_templates():
+    app.jinja_env.get_template(template_name)
+
+# Stały klucz podpisujący ciasteczka: SECRET_KEY ze środowiska albo plik instance/secret_key tworzony
+# przy pierwszym uruchomieniu, wspólny dla wszystkich procesów i kolejnych restartów
+app.secret_key = os.environ.get('SECRET_KEY') or load_secret_key(os.path.join(basedir, 'instance', 'secret_key'))
+init_database(app, 'sqlite:///' + os.path.join(basedir, 'instance', 'database.db'))
+
+# Utworzenie tabel w nowej bazie albo podniesienie istniejącej do najnowszej wersji schematu
 with app.app_context():
-    db.create_all()
-
-# Konfiguracja kamery
-camera = cv2.VideoCapture(0)
+    upgrade(db)
+
+# Szyna pub/sub łącząca procesy aplikacji: czat, obecność i klatki obrazu docierają przez nią do widzów
+# podłączonych do dowolnego procesu. Pusta - jeden proces, 'broker://host:port' - broker_server.py.
+app.config['PUBSUB_URL'] = os.environ.get('PUBSUB_URL', '')
+bus = create_bus(app.config['PUBSUB_URL'])
+
+# Sesje po stronie serwera (format magazynu opisany w sessions.py), czas trzymania sesji w pamięci procesu
+# oraz co ile sekund i jakimi porcjami są usuwane wygasłe sesje
+app.config['SESSION_STORE'] = os.environ.get('SESSION_STORE',
+                                             'sqlite:' + os.path.join(basedir, 'instance', 'sessions.db'))
+app.config['SESSION_CACHE_TTL'] = float(os.environ.get('SESSION_CACHE_TTL', 5))
+app.config['SESSION_PURGE_INTERVAL'] = int(os.environ.get('SESSION_PURGE_INTERVAL', 600))
+app.config['SESSION_PURGE_BATCH'] = int(os.environ.get('SESSION_PURGE_BATCH', 500))
+app.session_interface = ServerSessionInterface(create_session_store(app.config['SESSION_STORE']), bus,
+                                               cache_ttl=app.config['SESSION_CACHE_TTL'])
+
+def purge_sessions():
+    while True:
+        time.sleep(app.config['SESSION_PURGE_INTERVAL'])
+        try:
+            if bus.try_lease('session-purge', app.config['SESSION_PURGE_INTERVAL']):
+                app.session_interface.purge_expired(app.config['SESSION_PURGE_BATCH'])
+        except Exception as e:
+            print(f"Session purge error: {e}")
+
+session_purge_thread = Thread(target=purge_sessions)
+session_purge_thread.daemon = True
+session_purge_thread.start()
+
+# Źródła obrazu (format opisany w sources.py): domyślne dla wszystkich pokojów i wybrane dla konkretnych
+# pokojów, np. ROOM_FRAME_SOURCES=123456=file:demo.mp4. Kamera jest otwierana dopiero przy pierwszym widzu.
+app.config['FRAME_SOURCE'] = os.environ.get('FRAME_SOURCE', 'camera:0')
+app.config['ROOM_FRAME_SOURCES'] = os.environ.get('ROOM_FRAME_SOURCES', '')
+app.config['FRAME_SOURCE_IDLE_TIMEOUT'] = float(os.environ.get('FRAME_SOURCE_IDLE_TIMEOUT', 5))
+# Koder JPEG: 'auto', 'turbo' (pakiet PyTurboJPEG i biblioteka libjpeg-turbo) albo 'opencv'
+app.config['JPEG_BACKEND'] = os.environ.get('JPEG_BACKEND', 'auto')
+# Limit klatek na sekundę dla każdego źródła, 0 = tyle, ile daje źródło
+app.config['STREAM_MAX_FPS'] = float(os.environ.get('STREAM_MAX_FPS', 30))
+
+broadcasters = BroadcasterRegistry(app.config['FRAME_SOURCE'], parse_room_sources(app.config['ROOM_FRAME_SOURCES']),
+                                   idle_timeout=app.config['FRAME_SOURCE_IDLE_TIMEOUT'],
+                                   jpeg_backend=app.config['JPEG_BACKEND'],
+                                   max_fps=app.config['STREAM_MAX_FPS'], bus=bus)
+broadcaster = broadcasters.for_spec(app.config['FRAME_SOURCE'])
 
 def gen_frames():
-    while True:
-        success, frame = camera.read()
-        if not success:
-            break
-        else:
-            ret, buffer = cv2.imencode('.jpg', frame)
-            frame = buffer.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+    yield from broadcaster.viewer(broadcaster.tier_names[0])
+
+def get_room_broadcaster(room_code):
+    return broadcasters.for_room(room_code)
 
 @app.route('/video_feed')
 def video_feed():
@@ -45,41 +119,75 @@ def video_feed():
 
 # Główna strona aplikacji
 @app.route('/')
+@page_cache.cached(vary=('current_user',))
 def index():
     return render_template('index.html', current_user=session.get('current_user'))
 
 # Strona i logika rejestracji użytkownika
+# Hasła są hashowane w puli wątków: koszt (liczba iteracji PBKDF2), liczba wątków i limit zadań w kolejce.
+# Zmiana liczby iteracji działa od razu - stare hashe są zapisywane od nowa przy logowaniu.
+app.config['PASSWORD_HASH_ITERATIONS'] = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 600000))
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING',
+                                                             4 * app.config['PASSWORD_HASH_WORKERS']))
+
+passwords = PasswordHasher(iterations=app.config['PASSWORD_HASH_ITERATIONS'],
+                           workers=app.config['PASSWORD_HASH_WORKERS'],
+                           max_pending=app.config['PASSWORD_HASH_MAX_PENDING'])
+
+# Pełna kolejka haszowania haseł albo pełny bufor zapisu czatu: klient może spróbować za chwilę
+@app.errorhandler(CredentialsBusy)
+@app.errorhandler(ChatBufferFull)
+def server_busy(error):
+    return 'Serwer jest przeciążony, spróbuj ponownie za chwilę.', 503, {'Retry-After': '1'}
+
+def registration_error(username, email):
+    if User.query.filter_by(Name=username).first():
+        return "Użytkownik o tej nazwie już istnieje. Proszę wybrać inną nazwę."
+    if User.query.filter_by(Email=email).first():
+        return "Użytkownik o podanym adresie email już istnieje. Może chcesz się <a href='/login'>zalogować</a>?"
+    return None
+
 @app.route('/register', methods=['GET', 'POST'])
+@page_cache.cached()
 def register():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
         email = request.form['email']
 
-        existing_user = User.query.filter_by(Name=username).first()
-        if existing_user:
-            error_message = "Użytkownik o tej nazwie już istnieje. Proszę wybrać inną nazwę."
-            return render_template('register.html', error_message=error_message)
-        existing_user = User.query.filter_by(Email=email).first()
-        if existing_user:
-            error_message = "Użytkownik o podanym adresie email już istnieje. Może chcesz się <a href='/login'>zalogować</a>?"
+        error_message = registration_error(username, email)
+        if error_message:
             return render_template('register.html', error_message=error_message)
 
-        new_user = User(Name=username, Password=password, Email=email)
+        new_user = User(Name=username, Password=passwords.hash(password), Email=email)
         db.session.add(new_user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Równoległa rejestracja z tą samą nazwą lub adresem zdążyła przed nami (indeksy UNIQUE)
+            db.session.rollback()
+            error_message = registration_error(username, email) or "Nie udało się utworzyć konta. Spróbuj ponownie."
+            return render_template('register.html', error_message=error_message)
         return redirect(url_for('login'))
     return render_template('register.html')
 
 # Strona i logika logowania użytkownika
 @app.route('/login', methods=['GET', 'POST'])
+@page_cache.cached()
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
 
-        user = User.query.filter_by(Name=username, Password=password).first()
-        if user and user.Password == password:
+        user = User.query.filter_by(Name=username).first()
+        valid, rehash = passwords.verify(user.Password if user else None, password)
+        if valid:
+            if rehash:
+                user.Password = passwords.hash(password)
+                db.session.commit()
+            # Nowy identyfikator sesji po zalogowaniu, stary wiersz w magazynie jest usuwany
+            session.regenerate()
             session['user_id'] = user.UserID
             session['current_user'] = user.Name
             return redirect(url_for('index'))
@@ -88,15 +196,74 @@ def login():
             return render_template('login.html', error_message=error_message)
     return render_template('login.html')
 
-def get_chat_history(meeting_id):
-    chat_history = ChatMessage.query.filter_by(MeetingID=meeting_id).order_by(ChatMessage.MessageID.asc()).all()
-    return chat_history
+# Liczba wiadomości na jednej stronie historii czatu
+CHAT_PAGE_SIZE = 50
+CHAT_PAGE_SIZE_MAX = 200
+
+def get_chat_history(meeting_id, before=None, limit=CHAT_PAGE_SIZE):
+    # Stronicowanie po MessageID; autor dołączany w tym samym zapytaniu zamiast osobno dla każdej wiadomości
+    query = db.session.query(ChatMessage.MessageID, User.Name, ChatMessage.MessageContent) \
+        .outerjoin(User, ChatMessage.UserID == User.UserID) \
+        .filter(ChatMessage.MeetingID == meeting_id)
+    if before is not None:
+        query = query.filter(ChatMessage.MessageID < before)
+    rows = query.order_by(ChatMessage.MessageID.desc()).limit(limit).all()
+    return [message_to_dict(*row) for row in reversed(rows)]
+
+# Ostatnie wiadomości aktywnych pokojów trzymane w pamięci, żeby otwarcie pokoju nie czytało historii z bazy
+app.config['CHAT_CACHE_MESSAGES'] = int(os.environ.get('CHAT_CACHE_MESSAGES', 300))
+app.config['CHAT_CACHE_MEETINGS'] = int(os.environ.get('CHAT_CACHE_MEETINGS', 500))
+recent_messages = RecentMessageCache(per_meeting=app.config['CHAT_CACHE_MESSAGES'],
+                                     max_meetings=app.config['CHAT_CACHE_MEETINGS'])
+
+def get_recent_chat_history(meeting_id, limit=CHAT_PAGE_SIZE):
+    # Zwraca ostatnią stronę historii i informację, czy są starsze. Wiadomość zapisana w trakcie odczytu
+    # z bazy zmienia generację (store_message), więc taki wynik nie trafia do pamięci podręcznej.
+    cached = recent_messages.get(meeting_id, limit)
+    if cached is not None:
+        return cached
+
+    generation = recent_messages.generation(meeting_id)
+    fetch_limit = max(limit, CHAT_PAGE_SIZE)
+    messages = get_chat_history(meeting_id, limit=fetch_limit)
+    has_more = len(messages) == fetch_limit
+    recent_messages.fill(meeting_id, messages, has_more, generation)
+    return messages[-limit:], has_more or len(messages) > limit
+
+def get_chat_messages_after(meeting_id, after, limit=CHAT_PAGE_SIZE_MAX):
+    # Wiadomości nowsze niż `after` od najstarszej, dla klienta, który był chwilę rozłączony
+    messages = recent_messages.after(meeting_id, after)
+    if messages is not None:
+        return messages[:limit]
+    with app.app_context():
+        rows = db.session.query(ChatMessage.MessageID, User.Name, ChatMessage.MessageContent) \
+            .outerjoin(User, ChatMessage.UserID == User.UserID) \
+            .filter(ChatMessage.MeetingID == meeting_id, ChatMessage.MessageID > after) \
+            .order_by(ChatMessage.MessageID).limit(limit).all()
+        return [message_to_dict(*row) for row in rows]
 
 @app.route('/logout', methods=['GET'])
 def logout():
+    meeting_id = session.get('meeting_id')
+    if meeting_id:
+        leave_meeting(meeting_id)
     session.clear()
     return redirect(url_for('login'))
 
+# Limity żądań (format opisany w ratelimit.py) na użytkownika i na pokój. Przy RATE_LIMIT_SHARED=1 i szynie
+# pub/sub z brokerem limity są wspólne dla wszystkich procesów.
+app.config['RATE_LIMIT_SEND_MESSAGE'] = os.environ.get('RATE_LIMIT_SEND_MESSAGE', 'user=10/10,room=50/10')
+app.config['RATE_LIMIT_JOIN_ROOM'] = os.environ.get('RATE_LIMIT_JOIN_ROOM', 'user=10/60,room=60/60')
+app.config['RATE_LIMIT_SHARED'] = os.environ.get('RATE_LIMIT_SHARED', '1') == '1'
+
+rate_limit_bus = bus if app.config['RATE_LIMIT_SHARED'] and bus.distributed else None
+send_message_limits = RouteLimits('send_message', parse_limits(app.config['RATE_LIMIT_SEND_MESSAGE']), rate_limit_bus)
+join_room_limits = RouteLimits('join_room', parse_limits(app.config['RATE_LIMIT_JOIN_ROOM']), rate_limit_bus)
+
+@app.errorhandler(RateLimited)
+def rate_limited(error):
+    return 'Zbyt wiele żądań, spróbuj ponownie za chwilę.', 429, {'Retry-After': error.retry_after_header()}
+
 @app.route('/join_room', methods=['GET', 'POST'])
 def join_room():
     current_user = session.get('current_user')
@@ -105,6 +272,7 @@ def join_room():
 
     if request.method == 'POST':
         room_code = request.form['room_code']
+        join_room_limits.enforce(user=session['user_id'], room=room_code)
         if not room_code.isdigit():
             flash('Kod pokoju musi składać się tylko z cyfr.', 'error')
             return redirect(url_for('join_room'))
@@ -146,13 +314,40 @@ def create_room():
 
     return render_template('create_room.html', current_user=current_user, room_code=room_code)
 
-def join_meeting(meeting_id):
-    meeting = Meeting.query.get(meeting_id)
-    if meeting:
-        meeting.attendees_count += 1
-        db.session.commit()
+# Po ilu sekundach bez znaku życia (żądania strony pokoju lub kanału push) sesja opuszcza spotkanie
+PRESENCE_TIMEOUT = 60
+presence = PresenceRegistry(bus, timeout=PRESENCE_TIMEOUT)
+
+def get_presence_id():
+    # Identyfikator tej sesji przeglądarki w rejestrze obecności
+    if 'presence_id' not in session:
+        session['presence_id'] = secrets.token_hex(8)
+    return session['presence_id']
+
+def change_attendees_count(meeting_id, delta):
+    # Zmiana licznika wykonywana w samym UPDATE, bez odczytu i zapisu wartości w Pythonie
+    if delta >= 0:
+        new_count = Meeting.attendees_count + delta
     else:
-        raise ValueError("Meeting not found.")
+        new_count = case((Meeting.attendees_count > -delta, Meeting.attendees_count + delta), else_=0)
+    counts = db.session.execute(
+        update(Meeting).where(Meeting.MeetingID == meeting_id)
+        .values({Meeting.attendees_count: new_count, Meeting.last_activity: datetime.now()})
+        .returning(Meeting.attendees_count)
+    ).scalars().all()
+    db.session.commit()
+    # Puste spotkanie zostanie usunięte po okresie karencji, więc budzimy wątek sprzątania
+    if delta < 0 and 0 in counts:
+        reaper.wake()
+    return len(counts)
+
+def join_meeting(meeting_id):
+    meeting_id = int(meeting_id)
+    presence_id = get_presence_id()
+    if presence.join(meeting_id, presence_id):
+        if not change_attendees_count(meeting_id, 1):
+            presence.leave(meeting_id, presence_id)
+            raise ValueError("Meeting not found.")
 
 @app.route('/redirect_and_leave', methods=['GET', 'POST'])
 def redirect_and_leave():
@@ -162,24 +357,67 @@ def redirect_and_leave():
     return redirect(url_for('index'))
 
 def leave_meeting(meeting_id):
-    meeting = Meeting.query.get(meeting_id)
-    if meeting and meeting.attendees_count > 0:
-        meeting.attendees_count -= 1
-        db.session.commit()
-    elif meeting:
-        raise ValueError("No attendees to leave the meeting.")
-    else:
-        raise ValueError("Meeting not found.")
-
-def remove_inactive_meetings():
+    meeting_id = int(meeting_id)
+    if presence.leave(meeting_id, get_presence_id()):
+        change_attendees_count(meeting_id, -1)
+
+def reconcile_attendees(counts):
+    # Ustawia licznik w bazie na liczbę sesji w rejestrze obecności tam, gdzie się różnią
+    meetings = db.session.query(Meeting.MeetingID, Meeting.attendees_count) \
+        .filter(or_(Meeting.attendees_count != 0, Meeting.MeetingID.in_(list(counts)))).all()
+    changed = [(meeting_id, counts.get(meeting_id, 0)) for meeting_id, stored in meetings
+               if stored != counts.get(meeting_id, 0)]
+    for meeting_id, count in changed:
+        Meeting.query.filter_by(MeetingID=meeting_id) \
+            .update({Meeting.attendees_count: count, Meeting.last_activity: datetime.now()}, synchronize_session=False)
+    db.session.commit()
+    if any(count == 0 for _, count in changed):
+        reaper.wake()
+    return changed
+
+# Sesje, które zniknęły bez wejścia na /redirect_and_leave (np. zamknięta karta), są usuwane po czasie.
+# Obecność jest tylko w pamięci procesów, więc po restarcie w bazie zostają liczniki sesji, których
+# już nikt nie śledzi. Proces działający dłużej niż PRESENCE_TIMEOUT zna wszystkie sesje (każda daje znak
+# życia co PRESENCE_TIMEOUT / 4), więc zamiast odejmować wygasłe, ustawia liczniki na stan rejestru.
+def expire_presence():
+    started = time.monotonic()
     while True:
-        current_time = datetime.now()
-        if current_time.minute % 10 == 0:
-            inactive_meetings = Meeting.query.filter_by(attendees_count=0).all()
-            for meeting in inactive_meetings:
-                db.session.delete(meeting)
-            db.session.commit()
-        time.sleep(60)
+        time.sleep(PRESENCE_TIMEOUT / 2)
+        expired = presence.expire()
+        # Przy wielu procesach wszystkie widzą te same sesje, a licznik w bazie zmienia tylko jeden z nich
+        if not bus.try_lease('presence-expiry', PRESENCE_TIMEOUT * 2):
+            continue
+        try:
+            with app.app_context():
+                if time.monotonic() - started >= PRESENCE_TIMEOUT:
+                    changed = reconcile_attendees(presence.counts())
+                    if changed:
+                        print(f"Reconciled attendee counts: {changed}")
+                else:
+                    for meeting_id, count in expired.items():
+                        change_attendees_count(meeting_id, -count)
+        except Exception as e:
+            print(f"Presence expiry error: {e}")
+
+presence_thread = Thread(target=expire_presence)
+presence_thread.daemon = True
+presence_thread.start()
+
+# Puste spotkania są usuwane po okresie karencji od ostatniego wejścia lub wyjścia uczestnika
+app.config['MEETING_GRACE_PERIOD'] = int(os.environ.get('MEETING_GRACE_PERIOD', 600))
+app.config['MEETING_REAPER_INTERVAL'] = int(os.environ.get('MEETING_REAPER_INTERVAL', 60))
+
+reaper = MeetingReaper(app, grace_period=app.config['MEETING_GRACE_PERIOD'],
+                       interval=app.config['MEETING_REAPER_INTERVAL'],
+                       on_removed=recent_messages.invalidate, bus=bus)
+reaper.start()
+
+def settings_error(user, username, email):
+    if username and username != user.Name and User.query.filter_by(Name=username).first():
+        return 'Użytkownik o tej nazwie już istnieje.'
+    if email and email != user.Email and User.query.filter_by(Email=email).first():
+        return 'Użytkownik o podanym adresie email już istnieje.'
+    return None
 
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
@@ -201,14 +439,28 @@ def settings():
             flash('Hasła nie są identyczne.', 'error')
             return redirect(url_for('settings'))
 
-        if username:
+        # Nazwa i email są unikalne w bazie, więc zajęte wartości odrzucamy przed zapisem
+        error_message = settings_error(user, username, email)
+        if error_message:
+            flash(error_message, 'error')
+            return redirect(url_for('settings'))
+
+        if username and username != user.Name:
+            # Strony zapamiętane dla starej nazwy nie będą już potrzebne
+            page_cache.invalidate(value=user.Name)
             user.Name = username
         if email:
             user.Email = email
         if password:
-            user.Password = password
+            user.Password = passwords.hash(password)
 
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Nazwę lub adres zajął w międzyczasie ktoś inny
+            db.session.rollback()
+            flash(settings_error(user, username, email) or 'Nie udało się zapisać zmian. Spróbuj ponownie.', 'error')
+            return redirect(url_for('settings'))
 
         flash('Zmiany zostały zapisane.', 'success')
         return redirect(url_for('settings'))
@@ -216,10 +468,56 @@ def settings():
     current_email = User.query.filter_by(Name=current_user).first().Email
     return render_template('settings.html', current_user=current_user, current_email=current_email)
 
+# Kanały push czatu, do których podłączają się otwarte strony pokojów
+def remember_remote_message(meeting_id, event, data):
+    # Wiadomości innych procesów (tymczasowe, zapisane i odrzucone) trafiają też do pamięci podręcznej
+    if event == 'message':
+        recent_messages.append(meeting_id, data)
+    elif event == 'retract':
+        recent_messages.discard(meeting_id, data['key'])
+
+chat_channels = ChatChannels(bus, on_remote=remember_remote_message, replay=get_chat_messages_after)
+
+# Tryb zapisu wiadomości czatu ('batch' albo 'sync'), opis gwarancji trwałości w chat.ChatWriter
+app.config['CHAT_WRITE_MODE'] = os.environ.get('CHAT_WRITE_MODE', 'batch')
+app.config['CHAT_BATCH_SIZE'] = int(os.environ.get('CHAT_BATCH_SIZE', 200))
+app.config['CHAT_FLUSH_INTERVAL'] = float(os.environ.get('CHAT_FLUSH_INTERVAL', 0.2))
+
+app.config['CHAT_MAX_PENDING'] = int(os.environ.get('CHAT_MAX_PENDING', 10000))
+
+def accept_message(meeting_id, data):
+    # Wiadomość czekająca w buforze zapisu jest od razu widoczna w historii i w kanale push (bez numeru)
+    recent_messages.append(meeting_id, data)
+    chat_channels.publish(meeting_id, 'message', data)
+
+def store_message(meeting_id, data):
+    # Zapisana wiadomość (już z numerem) zastępuje tymczasową w historii w pamięci i na stronach
+    recent_messages.append(meeting_id, data)
+    # Do klientów wysyłamy tylko nową wiadomość, bez ponownego wczytywania historii
+    chat_channels.publish(meeting_id, 'message', data, event_id=data['id'])
+
+def drop_message(meeting_id, data):
+    # Wiadomość odrzucona przez bazę znika z historii i ze stron, które już ją pokazały
+    recent_messages.discard(meeting_id, data['key'])
+    chat_channels.publish(meeting_id, 'retract', {'key': data['key']})
+
+chat_writer = ChatWriter(app, mode=app.config['CHAT_WRITE_MODE'], batch_size=app.config['CHAT_BATCH_SIZE'],
+                         flush_interval=app.config['CHAT_FLUSH_INTERVAL'], on_stored=store_message,
+                         max_pending=app.config['CHAT_MAX_PENDING'], on_accepted=accept_message,
+                         on_dropped=drop_message)
+
+# Kontrolery przypisane do pokojów, np. CONTROLLER_GATEWAYS=123456:192.168.248.20:9090 - ich wejście
+# trafia do kanału push pokoju jako zdarzenia 'input'
+app.config['CONTROLLER_GATEWAYS'] = os.environ.get('CONTROLLER_GATEWAYS', '')
+app.config['CONTROLLER_INPUT_RATE'] = int(os.environ.get('CONTROLLER_INPUT_RATE', 60))
+
+controller_gateway = ControllerGateway(chat_channels, max_rate=app.config['CONTROLLER_INPUT_RATE'])
+for gateway_room, gateway_host, gateway_port in parse_gateways(app.config['CONTROLLER_GATEWAYS']):
+    controller_gateway.add(gateway_room, gateway_host, gateway_port)
+controller_gateway.start()
+
 def handle_message(msg, meeting_id):
-    new_message = ChatMessage(UserID=session['user_id'], MeetingID=meeting_id, MessageContent=msg)
-    db.session.add(new_message)
-    db.session.commit()
+    chat_writer.write(session['user_id'], session.get('current_user'), meeting_id, msg)
 
 @app.route('/room/<int:room_code>', methods=['GET', 'POST'])
 def room(room_code):
@@ -231,23 +529,113 @@ def room(room_code):
     if not meeting:
         flash('Spotkanie o podanym kodzie nie istnieje.', 'error')
         return redirect(url_for('join_room'))
-    chat_history = get_chat_history(room_code)
 
-    return render_template('room.html', current_user=current_user, room_code=room_code, chat_history=chat_history)
+    # Wejście na stronę pokoju (także po odświeżeniu) liczy się jako obecność w spotkaniu
+    session['meeting_id'] = room_code
+    join_meeting(room_code)
+    chat_history, has_more = get_recent_chat_history(room_code)
+
+    return render_template('room.html', current_user=current_user, room_code=room_code, chat_history=chat_history, has_more=has_more,
+                           axis_names=AXIS_NAMES, button_names=BUTTON_NAMES, server_time=time.time() * 1000)
+
+@app.route('/room/<int:room_code>/history')
+def room_history(room_code):
+    if 'user_id' not in session:
+        return jsonify(error='Nie jesteś zalogowany.'), 401
+
+    before = request.args.get('before', type=int)
+    limit = request.args.get('limit', CHAT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, CHAT_PAGE_SIZE_MAX))
+
+    if before is None:
+        messages, has_more = get_recent_chat_history(room_code, limit=limit)
+    else:
+        messages = get_chat_history(room_code, before=before, limit=limit)
+        has_more = len(messages) == limit
+    return jsonify(messages=messages, has_more=has_more)
+
+@app.route('/room/<int:room_code>/stream')
+def room_stream(room_code):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    room_broadcaster = get_room_broadcaster(room_code)
+    tier = request.args.get('quality')
+    if tier not in room_broadcaster.tier_names:
+        tier = None
+    return Response(room_broadcaster.viewer(tier, label=session.get('current_user')),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/room/<int:room_code>/stream/stats')
+def room_stream_stats(room_code):
+    # Liczba klatek na sekundę i opóźnienie każdego widza - kto nie nadąża za obrazem
+    if 'user_id' not in session:
+        return jsonify(error='Nie jesteś zalogowany.'), 401
+    return jsonify(get_room_broadcaster(room_code).stats())
 
 @app.route('/send_message/<int:room_code>', methods=['POST'])
 def send_message(room_code):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    send_message_limits.enforce(user=session['user_id'], room=room_code)
     message = request.form['message']
-    handle_message(message, room_code)
+    if len(message) > MESSAGE_MAX_LENGTH:
+        error_message = f'Wiadomość może mieć najwyżej {MESSAGE_MAX_LENGTH} znaków.'
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return error_message, 400
+        flash(error_message, 'error')
+        return redirect(url_for('room', room_code=room_code))
+    if message:
+        handle_message(message, room_code)
+
+    # Wysyłka z JavaScriptu nie potrzebuje przeładowania strony, nowa wiadomość przyjdzie kanałem push
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return '', 204
     return redirect(url_for('room', room_code=room_code))
 
+# Otwarty kanał push podtrzymuje obecność sesji w spotkaniu przy każdym zdarzeniu i keepalive.
+# refresh_presence zmienia tylko stan w pamięci i zwraca True przy wejściu do spotkania - wtedy
+# count_join zwiększa licznik w bazie (w asgi.py poza pętlą asyncio, bo czeka na bazę).
+def refresh_presence(room_code, presence_id):
+    return bool(presence_id) and presence.join(room_code, presence_id)
+
+def count_join(room_code):
+    with app.app_context():
+        change_attendees_count(room_code, 1)
+
+def presence_stream(room_code, presence_id, last_id=None):
+    for chunk in chat_channels.stream(room_code, last_id):
+        if refresh_presence(room_code, presence_id):
+            count_join(room_code)
+        yield chunk
+
+@app.route('/room/<int:room_code>/events')
+def room_events(room_code):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    presence_id = get_presence_id()
+    # Po zerwaniu połączenia przeglądarka podaje ostatni odebrany numer w Last-Event-ID, przy pierwszym
+    # połączeniu strona podaje ostatnią wyrenderowaną wiadomość w last_id
+    last_id = parse_last_event_id(request.headers.get('Last-Event-ID'), request.args.get('last_id'))
+    response = Response(presence_stream(room_code, presence_id, last_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/faq')
+@page_cache.cached()
 def faq():
     return render_template('faq.html')
 
 @app.route('/about')
+@page_cache.cached()
 def about():
     return render_template('about.html')
 
+# Serwer deweloperski; produkcyjnie aplikację uruchamia asgi.py. Debugger Werkzeuga pozwala wykonać kod
+# na serwerze, więc FLASK_DEBUG=1 nasłuchuje tylko na localhost (i wyłącza pamięć podręczną stron).
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    debug = os.environ.get('FLASK_DEBUG', '0') == '1'
+    app.run(host='127.0.0.1' if debug else '0.0.0.0', port=5000, debug=debug)
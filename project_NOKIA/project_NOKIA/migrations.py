@@ -0,0 +1,96 @@
+from datetime import datetime
+
+from sqlalchemy import DateTime, bindparam, inspect, text
+
+
+class MigrationError(Exception):
+    pass
+
+
+def require_unique(table, *columns):
+    # Indeks UNIQUE nie powstanie, jeśli wartości już się powtarzają (wcześniej settings() pozwalało
+    # zmienić nazwę na zajętą). Zamiast IntegrityError przy starcie zgłaszamy, które wiersze poprawić.
+    def step(connection):
+        problems = []
+        for column in columns:
+            duplicates = connection.execute(text(
+                f'SELECT "{column}", COUNT(*) FROM "{table}" WHERE "{column}" IS NOT NULL '
+                f'GROUP BY "{column}" HAVING COUNT(*) > 1')).all()
+            if duplicates:
+                values = ', '.join(f'{value!r} ({count}x)' for value, count in duplicates)
+                problems.append(f'{table}.{column}: {values}')
+        if problems:
+            raise MigrationError(
+                f'Nie można utworzyć unikalnych indeksów, powtarzają się wartości: {"; ".join(problems)}. '
+                f'Zmień lub usuń powtórzone wiersze w tabeli "{table}" i uruchom aplikację ponownie.')
+    return step
+
+
+# Kolejne wersje schematu bazy danych. Nowe migracje dopisujemy zawsze na końcu listy,
+# a już wydanych nie zmieniamy. Krok migracji to polecenie SQL albo funkcja przyjmująca połączenie.
+MIGRATIONS = [
+    (1, 'Indeksy dla logowania, rejestracji, historii czatu i usuwania pustych spotkań', [
+        require_unique('user', 'Name', 'Email'),
+        'CREATE UNIQUE INDEX IF NOT EXISTS "ix_user_Name" ON "user" ("Name")',
+        'CREATE UNIQUE INDEX IF NOT EXISTS "ix_user_Email" ON "user" ("Email")',
+        'CREATE INDEX IF NOT EXISTS "ix_meeting_attendees_count" ON "meeting" ("attendees_count")',
+        'CREATE INDEX IF NOT EXISTS "ix_chat_message_meeting_message" ON "chat_message" ("MeetingID", "MessageID")',
+    ]),
+    (2, 'Czas ostatniej aktywności spotkań i usunięcie wiadomości bez spotkania', [
+        'ALTER TABLE "meeting" ADD COLUMN last_activity DATETIME',
+        'CREATE INDEX IF NOT EXISTS "ix_meeting_last_activity" ON "meeting" (last_activity)',
+        lambda connection: connection.execute(
+            text('UPDATE "meeting" SET last_activity = :now').bindparams(bindparam('now', type_=DateTime)),
+            {'now': datetime.now()}),
+        'DELETE FROM "chat_message" WHERE "MeetingID" NOT IN (SELECT "MeetingID" FROM "meeting")',
+    ]),
+]
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(connection):
+    connection.execute(text('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)'))
+    return connection.execute(text('SELECT MAX(version) FROM schema_version')).scalar() or 0
+
+
+def upgrade(db):
+    # Nowa baza dostaje od razu aktualny schemat z modeli, istniejąca jest podnoszona krok po kroku
+    fresh = not inspect(db.engine).has_table('user')
+    if fresh:
+        db.create_all()
+        with db.engine.begin() as connection:
+            current_version(connection)
+            connection.execute(text('INSERT INTO schema_version (version) VALUES (:version)'),
+                               {'version': latest_version()})
+        return
+
+    with db.engine.begin() as connection:
+        version = current_version(connection)
+
+    for migration_version, description, steps in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        with db.engine.begin() as connection:
+            for step in steps:
+                if callable(step):
+                    step(connection)
+                else:
+                    connection.execute(text(step))
+            connection.execute(text('INSERT INTO schema_version (version) VALUES (:version)'),
+                               {'version': migration_version})
+        print(f"Migracja {migration_version}: {description}")
+
+    # Tabele dodane w nowych modelach, których jeszcze nie ma w bazie
+    db.create_all()
+
+
+if __name__ == '__main__':
+    # Import aplikacji sam podnosi schemat bazy do najnowszej wersji
+    from main import app, db
+
+    with app.app_context():
+        with db.engine.begin() as connection:
+            print(f"Wersja schematu bazy: {current_version(connection)} (najnowsza: {latest_version()})")
@@ -0,0 +1,93 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, render_template, request, session
+from markupsafe import Markup
+
+
+class PageCache:
+    # Wyrenderowane strony i fragmenty szablonów, które zależą tylko od kilku wartości sesji (np. current_user).
+    # Wpis żyje `ttl` sekund, najdawniej używane wpisy wypadają ponad `max_entries`. Szablony zmieniają się
+    # tylko przy wdrożeniu, więc pamięć procesu wystarcza; w trybie debug (przeładowanie szablonów)
+    # pamięć podręczna jest pomijana.
+    def __init__(self, ttl=300, max_entries=1000, enabled=True):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _active(self):
+        return self.enabled and not current_app.debug
+
+    def _get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def _put(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def cached(self, vary=()):
+        # Dekorator widoku: odpowiedź GET zapamiętana dla trasy i podanych wartości sesji. Parametry
+        # zapytania nie są częścią klucza - strony w pamięci podręcznej ich nie używają.
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                # Komunikaty flash zostałyby zjedzone przez zapamiętaną stronę, więc wtedy renderujemy zwykle
+                if not self._active() or request.method != 'GET' or '_flashes' in session:
+                    return view(*args, **kwargs)
+
+                key = ('page', request.endpoint, *(session.get(name) for name in vary))
+                entry = self._get(key)
+                if entry is None:
+                    response = current_app.make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    body = response.get_data()
+                    entry = (body, response.mimetype, hashlib.sha1(body).hexdigest())
+                    self._put(key, entry)
+
+                body, mimetype, etag = entry
+                response = Response(body, mimetype=mimetype)
+                response.set_etag(etag)
+                if vary:
+                    response.vary.add('Cookie')
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
+
+    def fragment(self, template_name, **context):
+        # Fragment szablonu renderowany raz dla danego kontekstu, w szablonie:
+        # {{ cached_fragment('header.html', current_user=current_user) }}
+        context = {name: value or None for name, value in context.items()}
+        if not self._active():
+            return Markup(render_template(template_name, **context))
+
+        key = ('fragment', template_name, tuple(sorted(context)), *(context[name] for name in sorted(context)))
+        fragment = self._get(key)
+        if fragment is None:
+            fragment = Markup(render_template(template_name, **context))
+            self._put(key, fragment)
+        return fragment
+
+    def invalidate(self, name=None, value=None):
+        # Usuwa wpisy trasy lub szablonu `name` i/lub zależne od wartości `value` (np. nazwy użytkownika);
+        # bez argumentów czyści wszystko
+        with self.lock:
+            for key in [key for key in self.entries
+                        if (name is None or key[1] == name) and (value is None or value in key[2:])]:
+                del self.entries[key]
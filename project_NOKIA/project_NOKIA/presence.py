@@ -0,0 +1,78 @@
+import json
+import secrets
+import threading
+import time
+from collections import Counter
+
+
+# Temat szyny pub/sub, którym procesy wymieniają wejścia i wyjścia sesji
+PRESENCE_TOPIC = 'presence'
+
+
+class PresenceRegistry:
+    # Obecność sesji przeglądarek w spotkaniach. Licznik uczestników w bazie zmieniamy tylko wtedy,
+    # gdy sesja faktycznie wchodzi lub wychodzi, więc powtórne wejścia i odświeżenia nic nie psują.
+    # Wejścia, wyjścia i co jakiś czas znaki życia są ogłaszane na szynie pub/sub, więc sesja
+    # obsługiwana na zmianę przez różne procesy jest liczona raz.
+    def __init__(self, bus, timeout=60):
+        self.bus = bus
+        self.timeout = timeout
+        self.origin = secrets.token_hex(8)
+        self.last_seen = {}
+        self.announced = {}
+        self.lock = threading.Lock()
+        bus.subscribe(PRESENCE_TOPIC, self._on_change)
+
+    def join(self, meeting_id, presence_id):
+        # Zwraca True, jeśli sesja dopiero weszła do spotkania
+        key = (meeting_id, presence_id)
+        now = time.monotonic()
+        with self.lock:
+            is_new = key not in self.last_seen
+            self.last_seen[key] = now
+            announce = is_new or now - self.announced.get(key, 0) > self.timeout / 4
+            if announce:
+                self.announced[key] = now
+        if announce:
+            self._publish('join', meeting_id, presence_id)
+        return is_new
+
+    def leave(self, meeting_id, presence_id):
+        # Zwraca True, jeśli sesja była w spotkaniu
+        key = (meeting_id, presence_id)
+        with self.lock:
+            self.announced.pop(key, None)
+            was_present = self.last_seen.pop(key, None) is not None
+        if was_present:
+            self._publish('leave', meeting_id, presence_id)
+        return was_present
+
+    def expire(self):
+        # Usuwa sesje, które nie dały znaku życia przez `timeout` sekund, i zwraca ich liczbę per spotkanie
+        deadline = time.monotonic() - self.timeout
+        with self.lock:
+            stale = [key for key, seen in self.last_seen.items() if seen < deadline]
+            for key in stale:
+                del self.last_seen[key]
+                self.announced.pop(key, None)
+        return Counter(meeting_id for meeting_id, _ in stale)
+
+    def counts(self):
+        # Liczba obecnych sesji w każdym spotkaniu według rejestru
+        with self.lock:
+            return Counter(meeting_id for meeting_id, _ in self.last_seen)
+
+    def _publish(self, action, meeting_id, presence_id):
+        self.bus.publish(PRESENCE_TOPIC, json.dumps([self.origin, action, meeting_id, presence_id]).encode())
+
+    def _on_change(self, payload):
+        origin, action, meeting_id, presence_id = json.loads(payload)
+        if origin == self.origin:
+            return
+        key = (meeting_id, presence_id)
+        with self.lock:
+            if action == 'join':
+                self.last_seen[key] = time.monotonic()
+            else:
+                self.last_seen.pop(key, None)
+                self.announced.pop(key, None)
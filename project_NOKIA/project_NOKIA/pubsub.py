@@ -0,0 +1,210 @@
+import itertools
+import socket
+import struct
+import threading
+import time
+
+from telemetry_client import Backoff
+
+
+# Szyna publikuj/subskrybuj łącząca procesy aplikacji (workery gunicorna, kilka maszyn). Wiadomość to
+# temat i dowolne bajty; subskrybent dostaje je w wywołaniu zwrotnym. Dzierżawa (try_lease) pozwala
+# wybrać jeden proces do zadania, np. przechwytywania obrazu z kamery.
+#
+# LocalBus działa w jednym procesie. BrokerBus łączy się z broker_server.py: wiadomość trafia od razu
+# do subskrybentów w tym procesie i przez broker do pozostałych procesów.
+#
+# Tryb awaryjny: gdy brokera nie ma, BrokerBus działa jak LocalBus - wiadomości docierają tylko do tego
+# procesu, a dzierżawy są przyznawane lokalnie, więc każdy proces sam przechwytuje obraz, wygasza
+# obecność itd. Po powrocie brokera dzierżawy znów ma tylko jeden proces.
+#
+# Protokół brokera: nagłówek (operacja, długość tematu, długość danych), temat, dane.
+MESSAGE = struct.Struct('!BHI')
+LEASE_REQUEST = struct.Struct('!II')
+LEASE_REPLY_BODY = struct.Struct('!IB')
+
+SUBSCRIBE = 1
+UNSUBSCRIBE = 2
+PUBLISH = 3
+LEASE = 4
+LEASE_REPLY = 5
+
+# Ile sekund czekamy na odpowiedź brokera w sprawie dzierżawy
+LEASE_TIMEOUT = 2
+
+
+def encode_message(op, topic, payload=b''):
+    topic = topic.encode()
+    return MESSAGE.pack(op, len(topic), len(payload)) + topic + payload
+
+
+class LocalBus:
+    distributed = False
+
+    def __init__(self):
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, topic, callback):
+        # Zwraca True przy pierwszej subskrypcji tematu w tym procesie
+        with self.lock:
+            callbacks = self.subscribers.setdefault(topic, [])
+            callbacks.append(callback)
+            return len(callbacks) == 1
+
+    def unsubscribe(self, topic, callback):
+        # Zwraca True, gdy była to ostatnia subskrypcja tematu w tym procesie
+        with self.lock:
+            callbacks = self.subscribers.get(topic)
+            if not callbacks or callback not in callbacks:
+                return False
+            callbacks.remove(callback)
+            if callbacks:
+                return False
+            del self.subscribers[topic]
+            return True
+
+    def publish(self, topic, payload):
+        self._dispatch(topic, payload)
+
+    def _dispatch(self, topic, payload):
+        with self.lock:
+            callbacks = list(self.subscribers.get(topic, ()))
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception as e:
+                print(f"Pub/sub callback error: {e}")
+
+    def try_lease(self, name, ttl):
+        # W jednym procesie nie ma z kim konkurować
+        return True
+
+    def release_lease(self, name):
+        pass
+
+
+class BrokerBus(LocalBus):
+    # Połączenie z broker_server.py utrzymywane przez wątek w tle; po zerwaniu łączy się ponownie
+    # i odnawia subskrypcje. Gdy brokera nie ma, wiadomości docierają tylko do tego procesu.
+    distributed = True
+
+    def __init__(self, host, port, backoff=None):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.backoff = backoff or Backoff()
+        self.socket = None
+        self.send_lock = threading.Lock()
+        self.requests = {}
+        self.request_ids = itertools.count(1)
+        # Ustawiane po pierwszej próbie połączenia, żeby dzierżawa przy starcie nie była przyznana lokalnie
+        # tylko dlatego, że połączenie jeszcze nie powstało
+        self.attempted = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def subscribe(self, topic, callback):
+        first = super().subscribe(topic, callback)
+        if first:
+            self._send(SUBSCRIBE, topic)
+        return first
+
+    def unsubscribe(self, topic, callback):
+        last = super().unsubscribe(topic, callback)
+        if last:
+            self._send(UNSUBSCRIBE, topic)
+        return last
+
+    def publish(self, topic, payload):
+        self._dispatch(topic, payload)
+        self._send(PUBLISH, topic, payload)
+
+    def try_lease(self, name, ttl):
+        # Dzierżawa należy do połączenia z brokerem: wygasa po `ttl` sekundach bez odnowienia
+        # albo od razu, gdy proces się rozłączy. Bez połączenia z brokerem przyznajemy ją lokalnie.
+        self.attempted.wait(LEASE_TIMEOUT)
+        request_id = next(self.request_ids)
+        reply = self.requests[request_id] = [threading.Event(), False]
+        try:
+            if not self._send(LEASE, name, LEASE_REQUEST.pack(request_id, max(1, int(ttl * 1000)))):
+                return True
+            reply[0].wait(LEASE_TIMEOUT)
+            return reply[1]
+        finally:
+            self.requests.pop(request_id, None)
+
+    def release_lease(self, name):
+        self._send(LEASE, name, LEASE_REQUEST.pack(0, 0))
+
+    def _send(self, op, topic, payload=b''):
+        data = encode_message(op, topic, payload)
+        with self.send_lock:
+            if self.socket is None:
+                return False
+            try:
+                self.socket.sendall(data)
+                return True
+            except OSError:
+                return False
+
+    def _run(self):
+        while True:
+            try:
+                connection = socket.create_connection((self.host, self.port))
+            except OSError as e:
+                print(f"Pub/sub broker error: {e}")
+                self.attempted.set()
+                time.sleep(self.backoff.next_delay())
+                continue
+
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.backoff.reset()
+            try:
+                with self.send_lock:
+                    with self.lock:
+                        topics = list(self.subscribers)
+                    for topic in topics:
+                        connection.sendall(encode_message(SUBSCRIBE, topic))
+                    self.socket = connection
+                self.attempted.set()
+                self._read(connection)
+            except OSError as e:
+                print(f"Pub/sub broker error: {e}")
+            finally:
+                with self.send_lock:
+                    self.socket = None
+                connection.close()
+            time.sleep(self.backoff.next_delay())
+
+    def _read(self, connection):
+        stream = connection.makefile('rb')
+        while True:
+            header = stream.read(MESSAGE.size)
+            if len(header) < MESSAGE.size:
+                return
+            op, topic_length, payload_length = MESSAGE.unpack(header)
+            topic = stream.read(topic_length).decode()
+            payload = stream.read(payload_length)
+            if len(payload) < payload_length:
+                return
+            if op == PUBLISH:
+                self._dispatch(topic, payload)
+            elif op == LEASE_REPLY:
+                request_id, granted = LEASE_REPLY_BODY.unpack(payload)
+                reply = self.requests.get(request_id)
+                if reply is not None:
+                    reply[1] = bool(granted)
+                    reply[0].set()
+
+
+def create_bus(url):
+    # '' albo 'local' - jeden proces, 'broker://host:port' - wspólny broker_server.py
+    if not url or url == 'local':
+        return LocalBus()
+    scheme, _, address = url.partition('://')
+    if scheme != 'broker':
+        raise ValueError(f"Unknown pub/sub URL: {url}")
+    host, _, port = address.rpartition(':')
+    return BrokerBus(host, int(port))
@@ -0,0 +1,104 @@
+import json
+import math
+import secrets
+import threading
+import time
+
+
+# Ograniczanie liczby żądań kubełkiem żetonów. Limit zapisuje się jako "zakres=liczba/sekundy",
+# np. "user=10/10,room=50/10": każdy użytkownik może wysłać 10 żądań na 10 sekund (seriami do 10),
+# a wszyscy razem w jednym pokoju 50. Pusty napis wyłącza limity trasy.
+#
+# Z szyną pub/sub (kilka procesów) każdy proces ogłasza przyjęte żądania, a pozostałe zdejmują
+# żetony z własnych kubełków, więc limit obowiązuje łącznie, a nie osobno w każdym procesie.
+RATELIMIT_TOPIC = 'ratelimit'
+
+# Co ile sekund usuwamy pełne kubełki - pełny kubełek niczym się nie różni od nowego
+PRUNE_INTERVAL = 60
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def parse_limits(value):
+    limits = {}
+    for entry in value.split(','):
+        entry = entry.strip()
+        if entry:
+            scope, _, limit = entry.partition('=')
+            count, _, period = limit.partition('/')
+            limits[scope.strip()] = (int(count), float(period or 1))
+    return limits
+
+
+class TokenBucketLimiter:
+    # Kubełek na klucz: `count` żetonów, które odnawiają się w tempie count/period na sekundę
+    def __init__(self, count, period):
+        self.capacity = count
+        self.rate = count / period
+        self.buckets = {}
+
+    def level(self, key, now):
+        tokens, updated = self.buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def wait_time(self, key, now):
+        missing = 1 - self.level(key, now)
+        return missing / self.rate if missing > 0 else 0
+
+    def consume(self, key, now):
+        self.buckets[key] = (max(0, self.level(key, now) - 1), now)
+
+    def prune(self, now):
+        for key in [key for key in self.buckets if self.level(key, now) >= self.capacity]:
+            del self.buckets[key]
+
+
+class RouteLimits:
+    # Limity jednej trasy dla kilku zakresów naraz (np. użytkownik i pokój). Żądanie jest przyjmowane
+    # tylko wtedy, gdy mieści się we wszystkich, i dopiero wtedy zużywa żetony.
+    def __init__(self, name, limits, bus=None):
+        self.name = name
+        self.limiters = {scope: TokenBucketLimiter(*limit) for scope, limit in limits.items()}
+        self.bus = bus
+        self.origin = secrets.token_hex(8)
+        self.lock = threading.Lock()
+        self.next_prune = time.monotonic() + PRUNE_INTERVAL
+        if bus is not None:
+            bus.subscribe(f'{RATELIMIT_TOPIC}:{name}', self._on_remote)
+
+    def enforce(self, **keys):
+        # Rzuca RateLimited z liczbą sekund do zwolnienia miejsca
+        keys = {scope: str(key) for scope, key in keys.items() if scope in self.limiters and key is not None}
+        if not keys:
+            return
+        now = time.monotonic()
+        with self.lock:
+            retry_after = max(self.limiters[scope].wait_time(key, now) for scope, key in keys.items())
+            if retry_after:
+                raise RateLimited(retry_after)
+            self._consume(keys, now)
+        if self.bus is not None:
+            self.bus.publish(f'{RATELIMIT_TOPIC}:{self.name}', json.dumps({'origin': self.origin, 'keys': keys}).encode())
+
+    def _consume(self, keys, now):
+        for scope, key in keys.items():
+            self.limiters[scope].consume(key, now)
+        if now >= self.next_prune:
+            self.next_prune = now + PRUNE_INTERVAL
+            for limiter in self.limiters.values():
+                limiter.prune(now)
+
+    def _on_remote(self, payload):
+        data = json.loads(payload)
+        if data['origin'] == self.origin:
+            return
+        keys = {scope: key for scope, key in data['keys'].items() if scope in self.limiters}
+        with self.lock:
+            self._consume(keys, time.monotonic())
@@ -0,0 +1,125 @@
+import json
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from db import db, Meeting, ChatMessage, SchedulerLease
+
+# Temat szyny pub/sub: usunięte spotkania (każdy proces czyści własną pamięć) i budzenie wątków sprzątania
+REAPER_TOPIC = 'reaper'
+
+class MeetingReaper:
+    # Usuwa puste spotkania po okresie karencji od ostatniej aktywności. Zadanie wykonuje tylko jeden
+    # proces naraz: ten, który trzyma dzierżawę w tabeli scheduler_lease.
+    LEASE_NAME = 'meeting_reaper'
+
+    def __init__(self, app, grace_period=600, interval=60, on_removed=None, bus=None):
+        self.app = app
+        self.grace_period = timedelta(seconds=grace_period)
+        self.interval = interval
+        self.lease_ttl = timedelta(seconds=interval * 3)
+        self.on_removed = on_removed
+        self.holder = f'{socket.gethostname()}:{os.getpid()}'
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        # Z szyną on_removed jest wywoływane w każdym procesie, a nie tylko w tym z dzierżawą
+        self.bus = bus
+        if bus is not None:
+            bus.subscribe(REAPER_TOPIC, self._on_event)
+
+    def start(self):
+        # Jeden wątek na proces, nawet jeśli start() zostanie wywołany kilka razy
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def wake(self):
+        # Spotkanie właśnie zostało puste: proces z dzierżawą przelicza termin następnego sprzątania
+        if self.bus is not None:
+            self.bus.publish(REAPER_TOPIC, json.dumps({'wake': True}).encode())
+        else:
+            self.wakeup.set()
+
+    def _on_event(self, payload):
+        data = json.loads(payload)
+        if 'removed' in data:
+            if self.on_removed:
+                self.on_removed(data['removed'])
+        else:
+            self.wakeup.set()
+
+    def _run(self):
+        while True:
+            delay = self.interval
+            try:
+                with self.app.app_context():
+                    if self.acquire_lease():
+                        self.reap()
+                        delay = self.seconds_until_next_expiry()
+            except Exception as e:
+                print(f"Meeting reaper error: {e}")
+            self.wakeup.wait(delay)
+            self.wakeup.clear()
+
+    def acquire_lease(self):
+        now = datetime.now()
+        expires_at = now + self.lease_ttl
+        with db.engine.begin() as connection:
+            renewed = connection.execute(
+                update(SchedulerLease)
+                .where(SchedulerLease.Name == self.LEASE_NAME)
+                .where(or_(SchedulerLease.Holder == self.holder, SchedulerLease.ExpiresAt < now))
+                .values(Holder=self.holder, ExpiresAt=expires_at)
+            ).rowcount
+        if renewed:
+            return True
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(SchedulerLease.__table__.insert().values(
+                    Name=self.LEASE_NAME, Holder=self.holder, ExpiresAt=expires_at))
+            return True
+        except IntegrityError:
+            return False
+
+    def expired_condition(self, now):
+        cutoff = now - self.grace_period
+        return (Meeting.attendees_count == 0) & or_(Meeting.last_activity < cutoff, Meeting.last_activity.is_(None))
+
+    def reap(self):
+        # Wiadomości wskazują spotkanie kluczem obcym, więc usuwamy je przed spotkaniem, w jednej transakcji.
+        # FOR UPDATE (PostgreSQL) blokuje wybrane spotkania, żeby nikt do nich nie dołączył w międzyczasie.
+        now = datetime.now()
+        with db.engine.begin() as connection:
+            removed = connection.execute(
+                select(Meeting.MeetingID).where(self.expired_condition(now)).with_for_update()
+            ).scalars().all()
+            if removed:
+                connection.execute(delete(ChatMessage).where(ChatMessage.MeetingID.in_(removed)))
+                connection.execute(delete(Meeting).where(Meeting.MeetingID.in_(removed)))
+
+        if removed:
+            print(f"Removed inactive meetings: {removed}")
+            if self.bus is not None:
+                self.bus.publish(REAPER_TOPIC, json.dumps({'removed': removed}).encode())
+            elif self.on_removed:
+                self.on_removed(removed)
+        return removed
+
+    def seconds_until_next_expiry(self):
+        # Budzimy się wtedy, gdy wygasa najbliższe puste spotkanie, ale nie rzadziej niż co `interval`
+        oldest = db.session.execute(
+            select(func.min(Meeting.last_activity)).where(Meeting.attendees_count == 0)
+        ).scalar()
+        db.session.remove()
+        if oldest is None:
+            return self.interval
+        due = (oldest + self.grace_period - datetime.now()).total_seconds()
+        return max(1, min(self.interval, due))
@@ -0,0 +1,264 @@
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+
+# Sesje po stronie serwera. Ciasteczko zawiera tylko podpisany identyfikator sesji, a zawartość
+# (user_id, current_user, meeting_id, ...) leży w magazynie wspólnym dla procesów aplikacji, więc
+# restart albo kolejny worker nie wylogowuje użytkowników. Magazyn wybiera się napisem:
+#
+#   sqlite:instance/sessions.db   - plik SQLite wspólny dla procesów na jednej maszynie
+#   memory                        - słownik w pamięci procesu (jeden proces, testy)
+#
+# Każdy proces trzyma ostatnio czytane sesje w pamięci przez `cache_ttl` sekund. Zapis sesji
+# ogłasza jej identyfikator na szynie pub/sub, żeby pozostałe procesy zapomniały nieaktualną kopię.
+SESSION_TOPIC = 'session'
+
+
+def load_secret_key(path):
+    # Klucz podpisujący z pliku; pierwszy proces tworzy plik, pozostałe czytają ten sam klucz.
+    # os.link nie nadpisuje istniejącego pliku, więc przy równoczesnym starcie wygrywa jeden klucz.
+    if not os.path.exists(path):
+        temporary = f'{path}.{os.getpid()}'
+        with open(temporary, 'w') as file:
+            file.write(secrets.token_hex(32))
+        try:
+            os.link(temporary, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporary)
+    with open(path) as file:
+        return file.read().strip()
+
+
+class MemorySessionStore:
+    # Magazyn klucz-wartość w pamięci procesu, zastępuje wspólny magazyn przy jednym procesie
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, sid, now):
+        entry = self.entries.get(sid)
+        if entry is None or entry[1] <= now:
+            return None
+        return entry
+
+    def set(self, sid, payload, expires):
+        self.entries[sid] = (payload, expires)
+
+    def touch(self, sid, expires):
+        with self.lock:
+            entry = self.entries.get(sid)
+            if entry is not None:
+                self.entries[sid] = (entry[0], expires)
+
+    def delete(self, sid):
+        self.entries.pop(sid, None)
+
+    def purge(self, now, limit):
+        with self.lock:
+            expired = [sid for sid, (_, expires) in self.entries.items() if expires <= now][:limit]
+            for sid in expired:
+                del self.entries[sid]
+        return len(expired)
+
+
+class SqliteSessionStore:
+    # Osobny plik SQLite (nie baza aplikacji), w trybie WAL odczyty sesji nie czekają na zapisy.
+    # Każdy wątek ma własne połączenie.
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        connection = self._connection()
+        connection.execute('CREATE TABLE IF NOT EXISTS sessions '
+                           '(id TEXT PRIMARY KEY, data BLOB NOT NULL, expires REAL NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS ix_sessions_expires ON sessions (expires)')
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def get(self, sid, now):
+        return self._connection().execute(
+            'SELECT data, expires FROM sessions WHERE id = ? AND expires > ?', (sid, now)).fetchone()
+
+    def set(self, sid, payload, expires):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (?, ?, ?)', (sid, payload, expires))
+
+    def touch(self, sid, expires):
+        self._connection().execute('UPDATE sessions SET expires = ? WHERE id = ?', (expires, sid))
+
+    def delete(self, sid):
+        self._connection().execute('DELETE FROM sessions WHERE id = ?', (sid,))
+
+    def purge(self, now, limit):
+        return self._connection().execute(
+            'DELETE FROM sessions WHERE id IN (SELECT id FROM sessions WHERE expires <= ? LIMIT ?)',
+            (now, limit)).rowcount
+
+
+def create_session_store(spec):
+    kind, _, argument = spec.partition(':')
+    if kind == 'memory':
+        return MemorySessionStore()
+    if kind == 'sqlite':
+        return SqliteSessionStore(argument)
+    raise ValueError(f"Unknown session store: {spec}")
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expires=0, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.new = new
+        self.modified = False
+        self.previous_sid = None
+
+    def regenerate(self):
+        # Nowy identyfikator przy zmianie uprawnień (logowanie): identyfikator znany przed
+        # zalogowaniem (np. podrzucony w ciasteczku) nie daje dostępu do zalogowanej sesji
+        if not self.new and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+    serializer = session_json_serializer
+
+    def __init__(self, store, bus, cache_ttl=5, cache_size=10000, refresh_interval=3600):
+        self.store = store
+        self.bus = bus
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        # Ważność niezmienianej sesji jest przedłużana najwyżej raz na `refresh_interval` sekund,
+        # a nie zapisem przy każdym żądaniu
+        self.refresh_interval = refresh_interval
+        self.origin = secrets.token_hex(8)
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        bus.subscribe(SESSION_TOPIC, self._on_change)
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='session-id')
+
+    def open_session(self, app, request):
+        value = request.cookies.get(self.get_cookie_name(app))
+        session = self.load(app, value) if value else None
+        if session is None:
+            return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+        return session
+
+    def load(self, app, value):
+        # Sesja dla wartości ciasteczka albo None; używane też przez asgi.py poza kontekstem żądania
+        try:
+            sid = self._signer(app).unsign(value).decode()
+        except BadSignature:
+            return None
+        entry = self._get(sid)
+        if entry is None:
+            return None
+        payload, expires = entry
+        return ServerSession(self.serializer.loads(payload.decode()), sid, expires)
+
+    def _get(self, sid):
+        now = time.time()
+        with self.lock:
+            entry = self.cache.get(sid)
+        if entry is not None and entry[2] > time.monotonic() and entry[1] > now:
+            return entry[0], entry[1]
+        # Nie zapamiętujemy braku sesji: sesja utworzona przez inny proces jest widoczna od razu
+        entry = self.store.get(sid, now)
+        if entry is None:
+            self._forget(sid)
+            return None
+        self._remember(sid, *entry)
+        return entry
+
+    def _remember(self, sid, payload, expires):
+        with self.lock:
+            self.cache[sid] = (payload, expires, time.monotonic() + self.cache_ttl)
+            self.cache.move_to_end(sid)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def _forget(self, sid):
+        with self.lock:
+            self.cache.pop(sid, None)
+
+    def _announce(self, sid):
+        if self.bus.distributed:
+            self.bus.publish(SESSION_TOPIC, f'{self.origin}:{sid}'.encode())
+
+    def _on_change(self, payload):
+        origin, _, sid = payload.decode().partition(':')
+        if origin != self.origin:
+            self._forget(sid)
+
+    def _delete(self, sid):
+        self.store.delete(sid)
+        self._forget(sid)
+        self._announce(sid)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.previous_sid is not None:
+            self._delete(session.previous_sid)
+            session.previous_sid = None
+        if not session:
+            # Pustej nowej sesji nie zapisujemy; wyczyszczona sesja znika z magazynu
+            if session.modified and not session.new:
+                self._delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        response.vary.add('Cookie')
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        if session.modified or session.new:
+            payload = self.serializer.dumps(dict(session)).encode()
+            session.expires = now + lifetime
+            self.store.set(session.sid, payload, session.expires)
+            self._remember(session.sid, payload, session.expires)
+            self._announce(session.sid)
+        elif session.expires - now < lifetime - self.refresh_interval:
+            session.expires = now + lifetime
+            self.store.touch(session.sid, session.expires)
+            self._forget(session.sid)
+        else:
+            return
+
+        response.set_cookie(name, self._signer(app).sign(session.sid).decode(),
+                            expires=self.get_expiration_time(app, session), httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path, secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+    def purge_expired(self, batch=500):
+        # Usuwa wygasłe sesje porcjami, żeby nie blokować zapisów innych procesów jednym długim DELETE
+        removed = 0
+        while True:
+            count = self.store.purge(time.time(), batch)
+            removed += count
+            if count < batch:
+                return removed
+            time.sleep(0.01)
@@ -0,0 +1,193 @@
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+
+# Źródła klatek dla FrameBroadcaster. Interfejs jest zgodny z cv2.VideoCapture: open() otwiera źródło
+# (zwraca False, gdy się nie udało), read() zwraca (sukces, klatka), release() zwalnia urządzenie
+# lub plik. Źródło wybiera się napisem, np.:
+#
+#   camera:0                   - kamera o podanym indeksie
+#   file:nagranie.mp4          - plik wideo odtwarzany w pętli z jego własną liczbą klatek na sekundę
+#   images:klatki/*.jpg@10     - kolejne obrazy pasujące do wzorca (albo wszystkie z katalogu), 10 kl./s
+#   synthetic:1280x720@30      - obraz testowy generowany w pamięci, bez żadnego sprzętu
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+class Pacer:
+    # Odstępy między klatkami dla źródeł, które same nie nadają tempa (pliki, obraz testowy).
+    # Po dłuższym przestoju nie nadrabiamy zaległych klatek seriami.
+    def __init__(self, fps):
+        self.interval = 1 / fps
+        self.next_frame = None
+
+    def wait(self):
+        now = time.monotonic()
+        if self.next_frame is None or now - self.next_frame > self.interval:
+            self.next_frame = now
+        elif self.next_frame > now:
+            time.sleep(self.next_frame - now)
+        self.next_frame += self.interval
+
+
+class FrameSource:
+    def open(self):
+        return True
+
+    def read(self):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+
+class CameraSource(FrameSource):
+    # Kamera sama wyznacza tempo klatek, read() czeka na kolejną
+    def __init__(self, index=0):
+        self.index = index
+        self.capture = None
+
+    def open(self):
+        self.capture = cv2.VideoCapture(self.index)
+        return self.capture.isOpened()
+
+    def read(self):
+        return self.capture.read()
+
+    def release(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+
+class VideoFileSource(FrameSource):
+    def __init__(self, path, loop=True):
+        self.path = path
+        self.loop = loop
+        self.capture = None
+        self.pacer = None
+
+    def open(self):
+        self.capture = cv2.VideoCapture(self.path)
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.pacer = Pacer(fps if fps and fps > 0 else 30)
+        return self.capture.isOpened()
+
+    def read(self):
+        self.pacer.wait()
+        success, frame = self.capture.read()
+        if not success and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            success, frame = self.capture.read()
+        return success, frame
+
+    def release(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+
+class ImageSequenceSource(FrameSource):
+    def __init__(self, pattern, fps=30, loop=True):
+        self.pattern = pattern
+        self.fps = fps
+        self.loop = loop
+        self.paths = []
+        self.position = 0
+        self.pacer = None
+
+    def open(self):
+        if os.path.isdir(self.pattern):
+            self.paths = sorted(os.path.join(self.pattern, name) for name in os.listdir(self.pattern)
+                                if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            self.paths = sorted(glob.glob(self.pattern))
+        self.position = 0
+        self.pacer = Pacer(self.fps)
+        return bool(self.paths)
+
+    def read(self):
+        if self.position >= len(self.paths):
+            if not self.loop:
+                return False, None
+            self.position = 0
+        self.pacer.wait()
+        frame = cv2.imread(self.paths[self.position])
+        self.position += 1
+        return frame is not None, frame
+
+
+class SyntheticSource(FrameSource):
+    # Pasy kolorów z poruszającym się prostokątem i licznikiem klatek - do testów obciążenia i CI
+    COLORS = [(255, 255, 255), (0, 255, 255), (255, 255, 0), (0, 255, 0),
+              (255, 0, 255), (0, 0, 255), (255, 0, 0), (0, 0, 0)]
+
+    def __init__(self, width=1280, height=720, fps=30):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.background = None
+        self.count = 0
+        self.pacer = None
+
+    def open(self):
+        self.background = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        bar_width = -(-self.width // len(self.COLORS))
+        for i, color in enumerate(self.COLORS):
+            self.background[:, i * bar_width:(i + 1) * bar_width] = color
+        self.count = 0
+        self.pacer = Pacer(self.fps)
+        return True
+
+    def read(self):
+        self.pacer.wait()
+        frame = self.background.copy()
+        size = self.height // 6
+        x = (self.count * 8) % max(1, self.width - size)
+        y = (self.height - size) // 2
+        cv2.rectangle(frame, (x, y), (x + size, y + size), (128, 128, 128), -1)
+        cv2.putText(frame, f'{self.count} {time.strftime("%H:%M:%S")}', (20, self.height - 30),
+                    cv2.FONT_HERSHEY_SIMPLEX, self.height / 720 * 1.5, (0, 0, 0), 3)
+        self.count += 1
+        return True, frame
+
+    def release(self):
+        self.background = None
+
+
+def split_fps(argument, default):
+    # "ścieżka@10" -> ("ścieżka", 10); bez poprawnego sufiksu zostaje domyślna wartość
+    value, separator, fps = argument.rpartition('@')
+    if separator and fps.replace('.', '', 1).isdigit():
+        return value, float(fps)
+    return argument, default
+
+
+def create_source(spec):
+    kind, _, argument = spec.partition(':')
+    if kind == 'camera':
+        return CameraSource(int(argument or 0))
+    if kind == 'file':
+        return VideoFileSource(argument)
+    if kind == 'images':
+        pattern, fps = split_fps(argument, 30)
+        return ImageSequenceSource(pattern, fps)
+    if kind == 'synthetic':
+        size, fps = split_fps(argument, 30)
+        width, _, height = size.partition('x')
+        return SyntheticSource(int(width or 1280), int(height or 720), fps)
+    raise ValueError(f"Unknown frame source: {spec}")
+
+
+def parse_room_sources(value):
+    # "pokój=źródło" rozdzielone przecinkami, np. "123456=file:demo.mp4,654321=synthetic:640x360@15"
+    rooms = {}
+    for entry in value.split(','):
+        entry = entry.strip()
+        if entry:
+            room_code, _, spec = entry.partition('=')
+            rooms[int(room_code)] = spec
+    return rooms
@@ -0,0 +1,498 @@
+import asyncio
+import json
+import struct
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from sources import create_source
+
+try:
+    from turbojpeg import TurboJPEG
+except ImportError:
+    TurboJPEG = None
+
+
+# Nagłówek części multipart poprzedzający każdą klatkę JPEG. Zaczyna się od CRLF kończącego poprzednią
+# część, więc klatka to tylko dwa fragmenty odpowiedzi: nagłówek i dane JPEG, bez sklejania ich w jeden bufor.
+# X-Timestamp to czas przechwycenia klatki (sekundy od epoki).
+FRAME_HEADER = b'\r\n--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\nX-Timestamp: %.3f\r\n\r\n'
+
+# Poziomy jakości od najlepszego: (nazwa, maksymalna wysokość w pikselach, jakość JPEG)
+QUALITY_TIERS = [
+    ('1080', 1080, 85),
+    ('720', 720, 75),
+    ('360', 360, 60),
+]
+
+# Ile klatek obserwujemy przed decyzją o zmianie poziomu jakości widza
+ADAPT_WINDOW = 30
+# Odsetek pominiętych klatek, powyżej którego widz schodzi poziom niżej
+DOWNGRADE_DROP_RATIO = 0.1
+# Ile kolejnych okien bez pominiętych klatek potrzeba, żeby wejść poziom wyżej
+UPGRADE_CLEAN_WINDOWS = 3
+# Po ilu sekundach bez widzów źródło klatek jest zwalniane (krótka przerwa, np. odświeżenie strony,
+# nie zamyka i nie otwiera ponownie kamery)
+IDLE_TIMEOUT = 5
+# Domyślny limit klatek na sekundę; klatki ze źródła, które przyszły przed czasem, nie są kodowane
+MAX_FPS = 30
+
+# Przy wielu procesach (szyna pub/sub) źródło trzyma jeden proces z dzierżawą i publikuje zakodowane
+# klatki, a pozostałe procesy z widzami tylko je przekazują. Proces przekazujący co DEMAND_INTERVAL
+# sekund ogłasza potrzebne poziomy jakości, a po RELAY_TIMEOUT sekundach bez klatek sam próbuje
+# przejąć źródło. Dzierżawa źródła wygasa po CAPTURE_LEASE_TTL sekundach bez odnowienia.
+DEMAND_INTERVAL = 1
+RELAY_TIMEOUT = 3
+CAPTURE_LEASE_TTL = 6
+
+# Klatka na szynie: czas przechwycenia i liczba poziomów, potem dla każdego poziomu nazwa i dane JPEG
+FRAME_MESSAGE = struct.Struct('!dB')
+TIER_ENTRY = struct.Struct('!BI')
+
+
+class JpegEncoder:
+    # Kodowanie JPEG przez 'opencv' (cv2.imencode) albo 'turbo' (libjpeg-turbo przez pakiet PyTurboJPEG).
+    # 'auto' wybiera turbo, jeśli pakiet i biblioteka są zainstalowane.
+    def __init__(self, backend='auto'):
+        self.turbo = None
+        if backend in ('auto', 'turbo') and TurboJPEG is not None:
+            try:
+                self.turbo = TurboJPEG()
+            except (OSError, RuntimeError):
+                self.turbo = None
+        if backend == 'turbo' and self.turbo is None:
+            print("JPEG encoder error: turbojpeg unavailable, using opencv")
+        self.backend = 'turbo' if self.turbo is not None else 'opencv'
+
+    def encode(self, image, quality):
+        if self.turbo is not None:
+            return self.turbo.encode(image, quality=quality)
+        ret, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        # WSGI wymaga bytes, więc jedna kopia z bufora numpy zostaje
+        return buffer.tobytes() if ret else None
+
+
+def frame_parts(payload, captured_at):
+    return (FRAME_HEADER % (len(payload), captured_at), payload)
+
+
+def encode_frame_message(captured_at, chunks):
+    parts = [FRAME_MESSAGE.pack(captured_at, len(chunks))]
+    for name, (_, payload) in chunks.items():
+        encoded_name = name.encode()
+        parts += [TIER_ENTRY.pack(len(encoded_name), len(payload)), encoded_name, payload]
+    return b''.join(parts)
+
+
+def decode_frame_message(message):
+    captured_at, count = FRAME_MESSAGE.unpack_from(message)
+    offset = FRAME_MESSAGE.size
+    chunks = {}
+    for _ in range(count):
+        name_length, payload_length = TIER_ENTRY.unpack_from(message, offset)
+        offset += TIER_ENTRY.size
+        name = message[offset:offset + name_length].decode()
+        offset += name_length
+        chunks[name] = frame_parts(message[offset:offset + payload_length], captured_at)
+        offset += payload_length
+    return captured_at, chunks
+
+
+class RateMeter:
+    # Liczba zdarzeń na sekundę liczona w oknach co najmniej `window` sekund
+    def __init__(self, window=1.0):
+        self.window = window
+        self.rate = 0.0
+        self.count = 0
+        self.start = time.monotonic()
+
+    def tick(self, now):
+        self.count += 1
+        if now - self.start >= self.window:
+            self.rate = self.count / (now - self.start)
+            self.count = 0
+            self.start = now
+
+    def value(self, now):
+        # Gdy zdarzenia ustały, ostatni pomiar byłby nieaktualny
+        elapsed = now - self.start
+        if elapsed >= 2 * self.window:
+            return self.count / elapsed
+        return self.rate
+
+
+class FrameBroadcaster:
+    # Jeden wątek przechwytuje klatkę i koduje ją raz na każdy używany poziom jakości,
+    # widzowie dostają zawsze najnowszą klatkę - kto nie nadąża, pomija starsze zamiast zbierać opóźnienie.
+    # Źródło jest otwierane przy pierwszym widzu i zwalniane, gdy przez idle_timeout sekund nikt nie ogląda.
+    def __init__(self, source, tiers=QUALITY_TIERS, idle_timeout=IDLE_TIMEOUT, jpeg_backend='auto', max_fps=MAX_FPS,
+                 bus=None, name=None):
+        self.source = source
+        self.bus = bus
+        self.name = name
+        # Poziomy jakości potrzebne widzom innych procesów: {poziom: do kiedy (time.monotonic())}
+        self.remote_demand = {}
+        self.last_remote_frame = 0
+        self.idle_timeout = idle_timeout
+        self.max_fps = max_fps
+        self.capture_rate = RateMeter()
+        self.jpeg = JpegEncoder(jpeg_backend)
+        # Bufory na pomniejszone klatki, używane ponownie przy każdej klatce (tylko wątek producenta)
+        self.resize_buffers = {}
+        self.tiers = tiers
+        self.tier_names = [name for name, _, _ in tiers]
+        self.viewers = {name: 0 for name in self.tier_names}
+        self.viewer_states = set()
+        # Najnowsza klatka: (numer, czas przechwycenia, {poziom: fragmenty odpowiedzi})
+        self.latest = None
+        self.seq = 0
+        self.running = False
+        self.condition = threading.Condition()
+        # Widzowie działający w pętli asyncio: (pętla, zdarzenie) budzone po każdej nowej klatce
+        self.async_waiters = set()
+        # Otwarcie źródła przez nowy wątek czeka, aż poprzedni skończy je zwalniać
+        self.source_lock = threading.Lock()
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        thread = threading.Thread(target=self._produce)
+        thread.daemon = True
+        thread.start()
+
+    def _topic(self, kind):
+        return f'{kind}:{self.name}'
+
+    def _local_tiers(self):
+        return {name for name, count in self.viewers.items() if count}
+
+    def _remote_tiers(self, now):
+        return {name for name, until in self.remote_demand.items() if until > now}
+
+    def _has_local_viewers(self):
+        return any(self.viewers.values())
+
+    def _has_viewers(self):
+        return self._has_local_viewers() or bool(self._remote_tiers(time.monotonic()))
+
+    def _produce(self):
+        while True:
+            if self.bus is None or self.bus.try_lease(self._topic('capture'), CAPTURE_LEASE_TTL):
+                with self.source_lock:
+                    failed = self._capture()
+                if self.bus is not None:
+                    self.bus.release_lease(self._topic('capture'))
+            else:
+                failed = self._relay()
+            with self.condition:
+                # Widz, który dołączył w trakcie zwalniania źródła, dostaje je otwarte ponownie
+                if failed or not self._has_viewers():
+                    self.running = False
+                    self.latest = None
+                    self._notify()
+                    return
+
+    def _capture(self):
+        # Zwraca True, gdy źródło nie daje klatek, i False, gdy zostało zamknięte z braku widzów
+        # albo inny proces przejął dzierżawę
+        if self.bus is not None:
+            self.bus.subscribe(self._topic('demand'), self._on_demand)
+        try:
+            if not self.source.open():
+                print("Frame source error: cannot open source")
+                return True
+            interval = 1 / self.max_fps if self.max_fps else 0
+            next_frame = 0
+            renew_lease = time.monotonic() + CAPTURE_LEASE_TTL / 3
+            while True:
+                with self.condition:
+                    if not self.condition.wait_for(self._has_viewers, self.idle_timeout):
+                        return False
+                if self.bus is not None and time.monotonic() >= renew_lease:
+                    if not self.bus.try_lease(self._topic('capture'), CAPTURE_LEASE_TTL):
+                        return False
+                    renew_lease = time.monotonic() + CAPTURE_LEASE_TTL / 3
+                success, frame = self.source.read()
+                if not success:
+                    return True
+
+                # Limit klatek z tolerancją pół odstępu, żeby drgania zegara źródła nie gubiły co drugiej klatki
+                now = time.monotonic()
+                if now < next_frame - interval / 2:
+                    continue
+                next_frame = max(next_frame + interval, now)
+
+                captured_at = time.time()
+                chunks = self._encode(frame, captured_at)
+                if not chunks:
+                    continue
+                with self.condition:
+                    self.seq += 1
+                    self.latest = (self.seq, captured_at, chunks)
+                    self.capture_rate.tick(now)
+                    self._notify()
+                    publish = self.bus is not None and self._remote_tiers(now)
+                if publish:
+                    self.bus.publish(self._topic('frames'), encode_frame_message(captured_at, chunks))
+        except Exception as e:
+            print(f"Frame source error: {e}")
+            return True
+        finally:
+            self.source.release()
+            if self.bus is not None:
+                self.bus.unsubscribe(self._topic('demand'), self._on_demand)
+                with self.condition:
+                    self.remote_demand.clear()
+
+    def _relay(self):
+        # Źródło trzyma inny proces: ogłaszamy potrzebne poziomy jakości i przekazujemy jego klatki.
+        # Zwraca False, gdy nie ma już widzów albo klatki przestały przychodzić.
+        self.bus.subscribe(self._topic('frames'), self._on_remote_frame)
+        self.last_remote_frame = time.monotonic()
+        announced = None
+        next_announce = 0
+        try:
+            while True:
+                with self.condition:
+                    if not self.condition.wait_for(self._has_local_viewers, self.idle_timeout):
+                        return False
+                    wanted = self._local_tiers()
+                now = time.monotonic()
+                if now - self.last_remote_frame > RELAY_TIMEOUT:
+                    return False
+                if wanted != announced or now >= next_announce:
+                    self.bus.publish(self._topic('demand'), json.dumps(sorted(wanted)).encode())
+                    announced = wanted
+                    next_announce = now + DEMAND_INTERVAL
+                with self.condition:
+                    self.condition.wait(DEMAND_INTERVAL)
+        finally:
+            self.bus.unsubscribe(self._topic('frames'), self._on_remote_frame)
+
+    def _on_remote_frame(self, message):
+        captured_at, chunks = decode_frame_message(message)
+        now = time.monotonic()
+        with self.condition:
+            self.last_remote_frame = now
+            self.seq += 1
+            self.latest = (self.seq, captured_at, chunks)
+            self.capture_rate.tick(now)
+            self._notify()
+
+    def _on_demand(self, message):
+        until = time.monotonic() + 3 * DEMAND_INTERVAL
+        with self.condition:
+            for name in json.loads(message):
+                if name in self.viewers:
+                    self.remote_demand[name] = until
+            self.condition.notify_all()
+
+    def _notify(self):
+        # Wywoływane z zajętym self.condition
+        self.condition.notify_all()
+        for loop, event in self.async_waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def _encode(self, frame, captured_at):
+        # Kodujemy tylko poziomy, które ktoś aktualnie ogląda, także w innych procesach
+        with self.condition:
+            wanted = self._local_tiers() | self._remote_tiers(time.monotonic())
+
+        chunks = {}
+        height, width = frame.shape[:2]
+        for name, max_height, quality in self.tiers:
+            if name not in wanted:
+                continue
+            if height > max_height:
+                scaled = self._resize(name, frame, (round(width * max_height / height), max_height))
+            else:
+                scaled = frame
+            payload = self.jpeg.encode(scaled, quality)
+            if payload:
+                chunks[name] = frame_parts(payload, captured_at)
+        return chunks
+
+    def _resize(self, name, frame, size):
+        shape = (size[1], size[0]) + frame.shape[2:]
+        buffer = self.resize_buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != frame.dtype:
+            buffer = self.resize_buffers[name] = np.empty(shape, frame.dtype)
+        return cv2.resize(frame, size, dst=buffer, interpolation=cv2.INTER_AREA)
+
+    def _set_viewer_tier(self, old, new):
+        with self.condition:
+            if old is not None:
+                self.viewers[old] -= 1
+            if new is not None:
+                self.viewers[new] += 1
+                self.condition.notify_all()
+
+    def _pick_chunk(self, chunks, tier):
+        # Tuż po zmianie poziomu klatka może nie mieć jeszcze wersji w nowej jakości
+        if tier in chunks:
+            return chunks[tier]
+        index = self.tier_names.index(tier)
+        for name in self.tier_names[index:] + self.tier_names[:index][::-1]:
+            if name in chunks:
+                return chunks[name]
+
+    def _next_frame(self, viewer):
+        # Wywoływane z zajętym self.condition. Zwraca klatkę dla widza, None gdy trzeba poczekać
+        # albo False, gdy producent zakończył pracę i nowych klatek nie będzie.
+        last_seq = viewer.last_seq
+        if self.latest is None or (last_seq is not None and self.seq <= last_seq):
+            return None if self.running else False
+
+        # Widz, który nie nadąża, przeskakuje od razu do najnowszej klatki
+        if last_seq is not None:
+            viewer.skipped(self.seq - last_seq - 1)
+        viewer.last_seq, viewer.captured_at, chunks = self.latest
+        return self._pick_chunk(chunks, viewer.tier)
+
+    def stats(self):
+        now = time.monotonic()
+        with self.condition:
+            viewers = [state.stats(now) for state in self.viewer_states]
+        return {'capture_fps': round(self.capture_rate.value(now), 1), 'viewers': viewers}
+
+    def viewer(self, tier=None, label=None):
+        state = ViewerState(self, tier, label)
+        self.start()
+        try:
+            while True:
+                with self.condition:
+                    chunk = self._next_frame(state)
+                    while chunk is None:
+                        self.condition.wait()
+                        chunk = self._next_frame(state)
+                if chunk is False:
+                    return
+                yield from chunk
+                state.frame_sent()
+        finally:
+            state.close()
+
+    async def async_viewer(self, tier=None, label=None):
+        # To samo co viewer(), ale czekanie na klatkę nie zajmuje wątku
+        state = ViewerState(self, tier, label)
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self.condition:
+            self.async_waiters.add(waiter)
+        self.start()
+        try:
+            while True:
+                waiter[1].clear()
+                with self.condition:
+                    chunk = self._next_frame(state)
+                if chunk is None:
+                    await waiter[1].wait()
+                    continue
+                if chunk is False:
+                    return
+                for part in chunk:
+                    yield part
+                state.frame_sent()
+        finally:
+            with self.condition:
+                self.async_waiters.discard(waiter)
+            state.close()
+
+
+class BroadcasterRegistry:
+    # Nadajnik dla każdego źródła klatek. Pokoje z tym samym źródłem (np. jedną kamerą) dzielą nadajnik,
+    # bo urządzenie można otworzyć tylko raz. Przy szynie łączącej procesy źródło otwiera tylko jeden z nich.
+    def __init__(self, default_spec, room_specs=None, idle_timeout=IDLE_TIMEOUT, jpeg_backend='auto', max_fps=MAX_FPS,
+                 bus=None):
+        self.default_spec = default_spec
+        self.bus = bus if bus is not None and bus.distributed else None
+        self.room_specs = room_specs or {}
+        self.idle_timeout = idle_timeout
+        self.jpeg_backend = jpeg_backend
+        self.max_fps = max_fps
+        self.broadcasters = {}
+        self.lock = threading.Lock()
+
+    def for_spec(self, spec):
+        with self.lock:
+            broadcaster = self.broadcasters.get(spec)
+            if broadcaster is None:
+                broadcaster = FrameBroadcaster(create_source(spec), idle_timeout=self.idle_timeout,
+                                               jpeg_backend=self.jpeg_backend, max_fps=self.max_fps,
+                                               bus=self.bus, name=spec)
+                self.broadcasters[spec] = broadcaster
+            return broadcaster
+
+    def for_room(self, room_code):
+        return self.for_spec(self.room_specs.get(room_code, self.default_spec))
+
+
+class ViewerState:
+    # Stan pojedynczego widza: ostatnia wysłana klatka i poziom jakości. Bez wskazanego poziomu
+    # jakość dopasowuje się do tempa, w jakim widz odbiera klatki.
+    def __init__(self, broadcaster, tier=None, label=None):
+        self.broadcaster = broadcaster
+        self.label = label
+        self.adaptive = tier is None
+        names = broadcaster.tier_names
+        self.tier = names[len(names) // 2] if self.adaptive else tier
+        self.last_seq = None
+        self.captured_at = None
+        self.frames = 0
+        self.drops = 0
+        self.clean_windows = 0
+        # Statystyki widoczne w FrameBroadcaster.stats()
+        self.rate = RateMeter()
+        self.lag = None
+        self.total_drops = 0
+        with broadcaster.condition:
+            broadcaster.viewer_states.add(self)
+        broadcaster._set_viewer_tier(None, self.tier)
+
+    def skipped(self, count):
+        self.drops += count
+        self.total_drops += count
+
+    def frame_sent(self):
+        # Wywoływane, gdy serwer przyjął klatkę do wysłania: opóźnienie od przechwycenia, średnia wykładnicza
+        lag = time.time() - self.captured_at
+        self.lag = lag if self.lag is None else self.lag * 0.9 + lag * 0.1
+        self.rate.tick(time.monotonic())
+
+        self.frames += 1
+        if not self.adaptive or self.frames < ADAPT_WINDOW:
+            return
+
+        names = self.broadcaster.tier_names
+        index = names.index(self.tier)
+        if self.drops > DOWNGRADE_DROP_RATIO * (self.frames + self.drops):
+            self.clean_windows = 0
+            index = min(index + 1, len(names) - 1)
+        elif self.drops == 0:
+            self.clean_windows += 1
+            if self.clean_windows >= UPGRADE_CLEAN_WINDOWS:
+                self.clean_windows = 0
+                index = max(index - 1, 0)
+        if names[index] != self.tier:
+            self.broadcaster._set_viewer_tier(self.tier, names[index])
+            self.tier = names[index]
+        self.frames = 0
+        self.drops = 0
+
+    def stats(self, now):
+        return {
+            'label': self.label,
+            'tier': self.tier,
+            'adaptive': self.adaptive,
+            'fps': round(self.rate.value(now), 1),
+            'lag_ms': round(self.lag * 1000, 1) if self.lag is not None else None,
+            'dropped': self.total_drops,
+        }
+
+    def close(self):
+        with self.broadcaster.condition:
+            self.broadcaster.viewer_states.discard(self)
+        self.broadcaster._set_viewer_tier(self.tier, None)
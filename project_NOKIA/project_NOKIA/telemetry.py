@@ -0,0 +1,251 @@
+import struct
+import time
+from collections import namedtuple
+
+
+# Binarny protokół stanu kontrolera. Każda ramka ma nagłówek: magic b'RC', wersja, typ ramki
+# i długość ładunku (uint16, big-endian). Ramka FRAME_SAMPLES niesie jedną lub więcej próbek,
+# każda to 6 osi float32 i maska 10 przycisków (uint16) - 26 bajtów zamiast ~100 bajtów tekstu.
+# Ramki nieznanej wersji lub typu są pomijane dzięki polu długości.
+#
+# Tryb zmian (DeltaEncoder): FRAME_KEYFRAME niesie pełny stan (jedna próbka), FRAME_DELTA tylko zmienione
+# pola - bajt z maską pól (bity 0-5 osie, bit 6 przyciski), a po nim zmienione osie (float32)
+# i maska przycisków (uint16), jeśli się zmieniła.
+MAGIC = b'RC'
+VERSION = 1
+HEADER = struct.Struct('!2sBBH')
+SAMPLE = struct.Struct('!6fH')
+DELTA_FIELDS = struct.Struct('!B')
+AXIS = struct.Struct('!f')
+BUTTONS = struct.Struct('!H')
+
+FRAME_SAMPLES = 1
+FRAME_KEYFRAME = 2
+FRAME_DELTA = 3
+
+AXIS_COUNT = 6
+BUTTON_COUNT = 10
+BUTTONS_CHANGED = 1 << AXIS_COUNT
+
+# Nazwy osi i przycisków w kolejności z próbki, dla klienta konsolowego i strony pokoju
+AXIS_NAMES = ["L3_X", "L3_Y", "L3_Z", "R3_X", "R3_Y", "R3_Z"]
+BUTTON_NAMES = ["Button L1", "Button R1", "Triangle", "Square", "Circle", "Cross", "Start", "Select", "UP/DOWN", "LEFT/RIGHT"]
+
+# Zmiana osi mniejsza niż DEAD_ZONE nie jest wysyłana; pełny stan co KEYFRAME_INTERVAL sekund
+DEAD_ZONE = 0.01
+KEYFRAME_INTERVAL = 1.0
+
+# Tekstowe wiadomości starego protokołu
+NAME_REQUEST = b'NAME'
+TEXT_START = b'data|'
+TEXT_END = b'|!'
+# Najdłuższa wiadomość tekstowa; bez końca |! w tym limicie strumień jest uznawany za uszkodzony
+MAX_TEXT_LENGTH = 4096
+
+Sample = namedtuple('Sample', ['axes', 'buttons'])
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def pack_buttons(buttons):
+    mask = 0
+    for i, pressed in enumerate(buttons):
+        if pressed:
+            mask |= 1 << i
+    return mask
+
+
+# Gotowe krotki stanów przycisków dla każdej z 1024 masek
+BUTTON_STATES = [tuple(bool(mask & (1 << i)) for i in range(BUTTON_COUNT)) for mask in range(1 << BUTTON_COUNT)]
+
+
+def unpack_buttons(mask):
+    return BUTTON_STATES[mask & ((1 << BUTTON_COUNT) - 1)]
+
+
+def encode_frame(frame_type, payload):
+    return HEADER.pack(MAGIC, VERSION, frame_type, len(payload)) + payload
+
+
+def encode_samples(samples):
+    payload = b''.join(SAMPLE.pack(*sample.axes, pack_buttons(sample.buttons)) for sample in samples)
+    return encode_frame(FRAME_SAMPLES, payload)
+
+
+def encode_text(samples):
+    # Ten sam stan w starym formacie tekstowym: data|osie|przyciski;...|!
+    rows = [f"{','.join(str(axis) for axis in sample.axes)}|{','.join('1' if pressed else '0' for pressed in sample.buttons)}"
+            for sample in samples]
+    return (TEXT_START.decode() + ';'.join(rows) + TEXT_END.decode()).encode('ascii')
+
+
+def parse_text_row(columns):
+    axes = tuple(float(value) for value in columns[0].split(','))
+    buttons = tuple(value != '0' for value in columns[1].split(','))
+    if len(axes) != AXIS_COUNT or len(buttons) != BUTTON_COUNT:
+        raise ProtocolError(f"Invalid text sample: {columns}")
+    return Sample(axes, buttons)
+
+
+class DeltaEncoder:
+    # Koder trybu zmian dla jednego połączenia. Oś jest wysyłana, gdy odsunie się o więcej niż dead_zone
+    # od ostatnio wysłanej wartości, przyciski - gdy zmieni się maska. Bezczynny kontroler nie generuje
+    # nic poza keyframe co keyframe_interval sekund, który naprawia stan odbiorcy (np. po martwej strefie).
+    def __init__(self, dead_zone=DEAD_ZONE, keyframe_interval=KEYFRAME_INTERVAL, clock=time.monotonic):
+        self.dead_zone = dead_zone
+        self.keyframe_interval = keyframe_interval
+        self.clock = clock
+        self.axes = None
+        self.buttons = None
+        self.next_keyframe = 0
+
+    def encode(self, sample):
+        now = self.clock()
+        mask = pack_buttons(sample.buttons)
+        if self.axes is None or now >= self.next_keyframe:
+            self.axes = list(sample.axes)
+            self.buttons = mask
+            self.next_keyframe = now + self.keyframe_interval
+            return encode_frame(FRAME_KEYFRAME, SAMPLE.pack(*sample.axes, mask))
+
+        fields = 0
+        payload = []
+        for i, value in enumerate(sample.axes):
+            if abs(value - self.axes[i]) > self.dead_zone:
+                fields |= 1 << i
+                self.axes[i] = value
+                payload.append(AXIS.pack(value))
+        if mask != self.buttons:
+            fields |= BUTTONS_CHANGED
+            self.buttons = mask
+            payload.append(BUTTONS.pack(mask))
+
+        # Nic się nie zmieniło - nic nie wysyłamy
+        if not fields:
+            return b''
+        return encode_frame(FRAME_DELTA, DELTA_FIELDS.pack(fields) + b''.join(payload))
+
+    def encode_samples(self, samples):
+        return b''.join(self.encode(sample) for sample in samples)
+
+
+class ChangeTracker:
+    # Pamięta ostatni stan kontrolera i zwraca tylko zmiany: ('axis', i, wartość) albo ('button', i, wciśnięty).
+    # Pierwsza próbka zwraca cały stan.
+    def __init__(self, dead_zone=DEAD_ZONE):
+        self.dead_zone = dead_zone
+        self.axes = None
+        self.buttons = None
+
+    def changes(self, sample):
+        changes = []
+        for i, value in enumerate(sample.axes):
+            if self.axes is None or abs(value - self.axes[i]) > self.dead_zone:
+                changes.append(('axis', i, value))
+        for i, pressed in enumerate(sample.buttons):
+            if self.buttons is None or pressed != self.buttons[i]:
+                changes.append(('button', i, pressed))
+
+        if self.axes is None:
+            self.axes = list(sample.axes)
+        for kind, i, value in changes:
+            if kind == 'axis':
+                self.axes[i] = value
+        self.buttons = sample.buttons
+        return changes
+
+
+class StreamDecoder:
+    # Dekoder strumienia TCP: przyjmuje dowolne kawałki danych z recv() i zwraca kompletne wiadomości,
+    # niezależnie od tego, jak TCP podzielił lub skleił ramki. Rozpoznaje ramki binarne,
+    # prośbę o nazwę (NAME) i wiadomości starego protokołu tekstowego. Ramki trybu zmian nakłada
+    # na odtworzony stan i zwraca jako pełne próbki; zmiany przed pierwszym keyframe są pomijane.
+    def __init__(self):
+        self.buffer = bytearray()
+        self.state = None
+
+    def feed(self, data):
+        # Zwraca listę zdarzeń: ('name', None) albo ('sample', Sample)
+        self.buffer += data
+        events = []
+        offset = 0
+        while offset < len(self.buffer):
+            consumed = self._decode_one(offset, events)
+            if consumed == 0:
+                break
+            offset += consumed
+        # Przetworzone dane usuwamy raz na wywołanie, a nie po każdej ramce
+        del self.buffer[:offset]
+        return events
+
+    def _decode_one(self, offset, events):
+        buffer = self.buffer
+        if buffer.startswith(MAGIC, offset):
+            if len(buffer) - offset < HEADER.size:
+                return 0
+            _, version, frame_type, length = HEADER.unpack_from(buffer, offset)
+            start = offset + HEADER.size
+            if len(buffer) < start + length:
+                return 0
+            if version == VERSION and frame_type in (FRAME_SAMPLES, FRAME_KEYFRAME):
+                if length % SAMPLE.size:
+                    raise ProtocolError(f"Invalid samples frame length: {length}")
+                for values in SAMPLE.iter_unpack(memoryview(buffer)[start:start + length]):
+                    self.state = Sample(values[:AXIS_COUNT], unpack_buttons(values[AXIS_COUNT]))
+                    events.append(('sample', self.state))
+            elif version == VERSION and frame_type == FRAME_DELTA:
+                self._apply_delta(buffer[start:start + length], events)
+            return HEADER.size + length
+
+        if buffer.startswith(NAME_REQUEST, offset):
+            events.append(('name', None))
+            return len(NAME_REQUEST)
+
+        if buffer.startswith(TEXT_START, offset):
+            end = buffer.find(TEXT_END, offset + len(TEXT_START), offset + MAX_TEXT_LENGTH)
+            if end == -1:
+                if len(buffer) - offset >= MAX_TEXT_LENGTH:
+                    raise ProtocolError(f"Text message longer than {MAX_TEXT_LENGTH} bytes")
+                return 0
+            text = buffer[offset + len(TEXT_START):end].decode('ascii')
+            for row in text.split(';'):
+                if row:
+                    events.append(('sample', parse_text_row(row.split('|'))))
+            return end + len(TEXT_END) - offset
+
+        # Początek znanej wiadomości, która jeszcze nie doszła w całości
+        rest = bytes(buffer[offset:offset + len(TEXT_START)])
+        for prefix in (MAGIC, NAME_REQUEST, TEXT_START):
+            if prefix.startswith(rest[:len(prefix)]):
+                return 0
+
+        # Nieznany bajt: pomijamy go, żeby zsynchronizować się z kolejną wiadomością
+        return 1
+
+    def _apply_delta(self, payload, events):
+        if not payload:
+            raise ProtocolError("Empty delta frame")
+        if self.state is None:
+            return
+
+        fields = payload[0]
+        changed_axes = [i for i in range(AXIS_COUNT) if fields & (1 << i)]
+        expected = DELTA_FIELDS.size + len(changed_axes) * AXIS.size
+        if fields & BUTTONS_CHANGED:
+            expected += BUTTONS.size
+        if len(payload) != expected:
+            raise ProtocolError(f"Invalid delta frame length: {len(payload)}")
+
+        axes = list(self.state.axes)
+        buttons = self.state.buttons
+        offset = DELTA_FIELDS.size
+        for i in changed_axes:
+            axes[i], = AXIS.unpack_from(payload, offset)
+            offset += AXIS.size
+        if fields & BUTTONS_CHANGED:
+            buttons = unpack_buttons(BUTTONS.unpack_from(payload, offset)[0])
+
+        self.state = Sample(tuple(axes), buttons)
+        events.append(('sample', self.state))
@@ -0,0 +1,121 @@
+import asyncio
+import random
+
+from telemetry import StreamDecoder
+
+
+class Backoff:
+    # Odstępy między kolejnymi próbami połączenia: rosną wykładniczo do `maximum`, z losowym rozrzutem,
+    # żeby setki klientów nie łączyły się ponownie w tej samej chwili
+    def __init__(self, initial=0.5, maximum=30, factor=2, jitter=0.2):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.attempt = 0
+
+    def reset(self):
+        self.attempt = 0
+
+    def next_delay(self):
+        delay = min(self.maximum, self.initial * self.factor ** self.attempt)
+        self.attempt += 1
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class ControllerLink:
+    # Połączenie z jednym serwerem kontrolera. Po zerwaniu połączenia łączy się ponownie z opóźnieniem
+    # z `backoff`, a odebrane próbki oddaje przez asynchroniczny iterator samples().
+    def __init__(self, host, port, name, backoff=None, read_size=4096):
+        self.host = host
+        self.port = port
+        self.name = name
+        self.backoff = backoff or Backoff()
+        self.read_size = read_size
+        self.writer = None
+        self.closed = False
+
+    @property
+    def address(self):
+        return f"{self.host}:{self.port}"
+
+    async def samples(self):
+        while not self.closed:
+            try:
+                reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                print(f"[{self.address}] Connection failed: {e}")
+                await asyncio.sleep(self.backoff.next_delay())
+                continue
+
+            self.backoff.reset()
+            decoder = StreamDecoder()
+            try:
+                while True:
+                    data = await reader.read(self.read_size)
+                    if not data:
+                        break
+                    for event, sample in decoder.feed(data):
+                        if event == 'name':
+                            self.writer.write(self.name.encode('ascii'))
+                            await self.writer.drain()
+                        else:
+                            yield sample
+            except (OSError, ValueError) as e:
+                print(f"[{self.address}] Connection lost: {e}")
+            finally:
+                self.writer.close()
+                self.writer = None
+
+            if not self.closed:
+                await asyncio.sleep(self.backoff.next_delay())
+
+    async def send(self, message):
+        if self.writer is None:
+            return False
+        self.writer.write(message.encode('ascii'))
+        await self.writer.drain()
+        return True
+
+    def close(self):
+        self.closed = True
+        if self.writer is not None:
+            self.writer.close()
+
+
+class ControllerHub:
+    # Wiele połączeń z serwerami kontrolerów w jednej pętli asyncio. Próbki ze wszystkich połączeń trafiają
+    # do jednej ograniczonej kolejki; gdy odbiorca nie nadąża, połączenia przestają czytać z gniazd.
+    def __init__(self, name, queue_size=1000, backoff=None):
+        self.name = name
+        self.backoff = backoff
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.links = []
+        self.tasks = []
+
+    def subscribe(self, host, port):
+        backoff = Backoff(self.backoff.initial, self.backoff.maximum, self.backoff.factor,
+                          self.backoff.jitter) if self.backoff else None
+        link = ControllerLink(host, port, self.name, backoff)
+        self.links.append(link)
+        self.tasks.append(asyncio.ensure_future(self._pump(link)))
+        return link
+
+    async def _pump(self, link):
+        async for sample in link.samples():
+            await self.queue.put((link, sample))
+
+    async def send_all(self, message):
+        await asyncio.gather(*(link.send(message) for link in self.links))
+
+    def close(self):
+        for link in self.links:
+            link.close()
+        for task in self.tasks:
+            task.cancel()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.queue.get()